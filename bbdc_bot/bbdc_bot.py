@@ -8,7 +8,6 @@ from bbdc_slot_finder import (
     load_config,
     UserSession,
     BbdcApi,
-    start_browser,
     TokenExpireError,
 )
 from bbdc_bot.conv_book_slots import (
@@ -16,6 +15,16 @@ from bbdc_bot.conv_book_slots import (
     browser_book,
 )
 from bbdc_bot.conv_config_bot import config_conv_handler
+from bbdc_slot_finder.slot_diff import ADDED, REMOVED
+from bbdc_slot_finder.slot_store import SlotStore
+from bbdc_slot_finder.event_loop import say
+from bbdc_slot_finder.browser_manager import get_browser_manager
+from bbdc_bot.camp_schedule import (
+    MIN_INTERVAL,
+    CampSchedule,
+    apply_schedule,
+    get_burst_budget,
+)
 import os, json
 
 
@@ -90,6 +99,8 @@ async def command_login(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             force_login = True
     status = False
     try:
+        from bbdc_slot_finder.async_playwright_browser_ops import start_browser
+
         status = await start_browser(
             context.chat_data["config"],
             directory=f"user/{chat_id}",
@@ -108,13 +119,41 @@ async def command_login(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         await message.edit_text(f"Log in failed...{e}")
 
 
+async def report_slot_events(context, chat_id, events) -> SlotStore:
+    """Announce new slots and slots that were taken; returns the new slots."""
+    added = SlotStore()
+    removed = []
+    for event in events:
+        if event.kind == ADDED:
+            msg = display_slot(event.slot)
+            logger.info(msg)
+            await context.bot.send_message(chat_id=chat_id, text=msg)
+            added[event.key] = event.slot
+        elif event.kind == REMOVED:
+            logger.info(
+                f"Slot {event.key} gone, seen {event.first_seen} to {event.last_seen}"
+            )
+            removed.append(event.slot)
+        else:
+            logger.info(f"Slot {event.key} changed")
+    if removed:
+        await context.bot.send_message(
+            chat_id=chat_id,
+            text="No longer available:\n"
+            + "\n".join(
+                f"{slot.slot_date} Session {slot.session}" for slot in removed
+            ),
+        )
+    return added
+
+
 def display_slot(slot):
     message = f"""
 Slot Available!
-ID: {slot['slots_code']}
-Date: {datetime.datetime.strptime(slot['slot_date'], '%Y-%m-%d').strftime('%Y-%m-%d (%a)')}
-Session {slot["session"]}: {slot["start_time"]}-{slot["end_time"]}
-Total Fee: {slot["total_fee"]}
+ID: {slot.key}
+Date: {slot.day.strftime('%Y-%m-%d (%a)')}
+Session {slot.session}: {slot.start_time}-{slot.end_time}
+Total Fee: {slot.total_fee}
 """
     return message
 
@@ -127,7 +166,6 @@ async def command_check(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             config = context.chat_data["config"] = UserSession(chat_id)
             if not config._client:
                 session = context.chat_data["client"] = BbdcApi(config)
-                await session.init_playwright_browser()
 
         except NameError as e:
             await update.message.reply_text("Ooops! User not found.")
@@ -137,20 +175,11 @@ async def command_check(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
     try:
         message = await update.message.reply_text("Checking...")
-        if not (hasattr(session, "_browser") or session.stop):
-            # if browser not exists, and session not stopped:
-            await session.init_playwright_browser()
-        async for new_slots in session.scan_slots():
+        await session.init_scan_client()
+        async for events in session.scan_slots():
+            new_slots = await report_slot_events(context, chat_id, events)
             if len(new_slots) and config["autobook"]["Ding"]:
-                os.system("say -v bubbles Ding")
-            for slot, item in new_slots.items():
-                if slot not in config.released_slots:
-                    msg = display_slot(item)
-                    logger.info(msg)
-                    await context.bot.send_message(chat_id=chat_id, text=msg)
-                else:
-                    logger.info(f"Slot {slot} found again")
-                    pass
+                say("Ding", voice="bubbles")
             if len(new_slots):
                 await autobook_processor(update, context, new_slots)
     except TokenExpireError as e:
@@ -158,7 +187,7 @@ async def command_check(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         return
     except Exception as e:
         logger.error(e)
-        os.system("say --voice='Bad News' Oooops! Camper quits")
+        say("Oooops! Camper quits", voice="Bad News")
         await message.edit_text(f"Error: {e}")
         raise (e)
     await print_current_slots(update, context, message=message)
@@ -180,30 +209,32 @@ async def autobook_processor(update: Update, context, slots_list=None):
         trysell_auto = bool(config["autobook"]["trysell"])
         trysell_sessions = config.get("trysell_session", [])
         advance_auto = bool(config["autobook"]["advance"])
-        trysell_condition = (
-            datetime.date.today() + datetime.timedelta(hours=24)
-        ).strftime("%Y%m%d")
+        # try-sell slots are the ones within 24h
+        trysell_condition = datetime.date.today() + datetime.timedelta(hours=24)
+        if not isinstance(slots_list, SlotStore):
+            slots_list = SlotStore(slots_list)
 
         if trysell_auto or advance_auto:
-            trysell_slots = []
-            advance_slots = []
-            for slot in slots_list:  # %Y%m%d\d-\d+
-                if slot[:8] <= trysell_condition:
-                    if slot[8] in trysell_sessions:
-                        trysell_slots += [slot]
-                else:
-                    advance_slots += [slot]
-            if trysell_auto and advance_auto:
-                slots = trysell_slots + advance_slots
-            else:  # only one
-                slots = (
-                    trysell_slots if config["autobook"]["trysell"] else advance_slots
-                )
-
-            context.chat_data["book"]["slots"] = {i: slots_list[i] for i in slots}
-            context.chat_data["book"]["all"] = len(
-                context.chat_data["book"]["slots"]
-            ) == len(slots_list)
+            slots = SlotStore()
+            if trysell_auto:
+                for slot in slots_list.query(
+                    end=trysell_condition, sessions=trysell_sessions
+                ):
+                    slots[slot.key] = slot
+            if advance_auto:
+                for slot in slots_list.query(
+                    start=trysell_condition + datetime.timedelta(days=1)
+                ):
+                    slots[slot.key] = slot
+
+            context.chat_data["book"]["slots"] = slots
+            # select_all clicks every slot shown for the month, so only when
+            # all the user's released slots of that month are to be booked;
+            # slots_list may be just the slots new since the last scan
+            months = slots.months()
+            context.chat_data["book"]["all"] = len(months) == 1 and set(slots) == set(
+                config.released_slots.keys_in_month(months[0])
+            )
 
             if context.chat_data["book"]["slots"]:
                 context.chat_data["book"]["auto"] = True
@@ -220,7 +251,7 @@ async def print_current_slots(
         slots_list = context.chat_data["config"].released_slots
         msg = "Available slots summary:\n"
         msg += "\n".join(
-            f'{slots_list[i]["slot_date"]} Session {slots_list[i]["session"]}'
+            f"{slots_list[i].slot_date} Session {slots_list[i].session}"
             for i in slots_list
         )
     else:
@@ -236,23 +267,17 @@ async def camper(context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send the alarm message."""
     job = context.job
     chat_id = job.chat_id
-    config: UserSession = context.chat_data["config"]
     session: BbdcApi = context.chat_data.get("client", {})
-    if not (hasattr(session, "_browser_page") or session.stop):
-        # if browser not exists, and session not stopped:
-        await session.init_playwright_browser(headless=False)
     try:
-        async for new_slots in session.scan_slots():
-            for slot, item in new_slots.items():
-                if slot not in config.released_slots:
-                    msg = display_slot(item)
-                    logger.info(msg)
-                    await context.bot.send_message(chat_id=chat_id, text=msg)
-                else:
-                    logger.info(f"Slot {slot} found again")
-                    pass
+        await session.init_scan_client(headless=False)
+        async for events in session.scan_slots():
+            new_slots = await report_slot_events(context, chat_id, events)
             if len(new_slots):
                 await autobook_processor(job, context, new_slots)
+        schedule = context.chat_data.get("camp_schedule")
+        if schedule is not None and not job.removed:
+            # speed up inside release windows, relax outside them
+            apply_schedule(job, schedule)
     except TokenExpireError as e:
         job.schedule_removal()
         remove_job_if_exists(name=f"{chat_id}", context=context)
@@ -261,7 +286,7 @@ async def camper(context: ContextTypes.DEFAULT_TYPE) -> None:
         )
 
     except Exception as e:
-        os.system("say --voice='Bahh' Oooops! ")
+        say("Oooops! ", voice="Bahh")
 
         job.schedule_removal()
         remove_job_if_exists(name=f"{chat_id}", context=context)
@@ -286,6 +311,8 @@ def remove_job_if_exists(name: str, context: ContextTypes.DEFAULT_TYPE) -> bool:
     end_job = context.job_queue.get_jobs_by_name(name + "end")
     for job in end_job:
         job.schedule_removal()
+    get_burst_budget().leave(name)
+    get_browser_manager().forget(f"user/{name}")
     return True
 
 
@@ -294,8 +321,26 @@ async def command_camp(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     chat_id = update.effective_message.chat_id
     try:
         due = float(context.args[0])
-        if due < 30:
-            await update.effective_message.reply_text("Minimum interval is 30 seconds!")
+        if due < MIN_INTERVAL:
+            await update.effective_message.reply_text(
+                f"Minimum interval is {MIN_INTERVAL} seconds!"
+            )
+            return
+        current_jobs = context.job_queue.get_jobs_by_name(str(chat_id))
+        if (
+            len(context.args) == 1
+            and current_jobs
+            and "camp_schedule" in context.chat_data
+        ):
+            # retime the running job; keep its browser page and end time
+            schedule = context.chat_data["camp_schedule"]
+            schedule.interval = due
+            context.chat_data["repeat_due"] = due
+            interval = apply_schedule(current_jobs[0], schedule)
+            text = f"Camping interval updated to {due} seconds"
+            if interval != schedule.interval:
+                text += f" ({interval:.0f} s in the current release window)"
+            await update.effective_message.reply_text(text + ".")
             return
         if len(context.args) > 1:
             start_time = float(context.args[1])  # in hours
@@ -325,6 +370,9 @@ async def command_camp(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         try:
             job_removed = remove_job_if_exists(str(chat_id), context)
             context.chat_data["repeat_due"] = due
+            schedule = context.chat_data["camp_schedule"] = CampSchedule.from_config(
+                due, context.chat_data["config"]
+            )
             # if start_time > 5 * 3600:
             # context.job_queue.run_once(
             #    command_login, start_time - 30, name=str(chat_id) + "login"
@@ -341,6 +389,14 @@ async def command_camp(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             )
 
             text = f"Camping bot successfully set, repeat every {due} seconds. "
+            if schedule.windows:
+                text += (
+                    "Every "
+                    f"{get_burst_budget().interval(schedule.burst_interval):.0f}"
+                    " seconds or so during "
+                    + ", ".join(str(w) for w in schedule.windows)
+                    + ". "
+                )
             if start_time:
                 text += f"Start {start_time/3600:.1f} hours later. "
             if end_time:
@@ -367,6 +423,8 @@ async def command_camp(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 async def notify_job_end(context):
     job = context.job
     chat_id = job.chat_id
+    get_burst_budget().leave(str(chat_id))
+    get_browser_manager().forget(f"user/{chat_id}")
     try:
         await context.chat_data["client"].close_client()
     except:
@@ -403,19 +461,16 @@ async def command_myschedule(update: Update, context: ContextTypes.DEFAULT_TYPE)
         try:
             config = context.chat_data["config"] = UserSession(chat_id)
             session = context.chat_data["client"] = BbdcApi(config)
-            await session.init_playwright_browser()
         except NameError as e:
             await update.message.reply_text("Ooops! User not found.")
             return
-    if not (hasattr(session, "_browser") or session.stop):
-        # if browser not exists, and session not stopped:
-        await session.init_playwright_browser()
     days = int(context.args[0]) if context.args else 7
     days_text = (datetime.date.today() + datetime.timedelta(days=days)).strftime(
         "%Y-%m-%d"
     )
     try:
         text = ""
+        await session.init_scan_client()
         schedules = await session.list_scheduled()
         schedules_session = sorted(schedules)
         if schedules_session:
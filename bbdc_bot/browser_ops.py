@@ -1,4 +1,3 @@
-from bbdc_slot_finder.browser_login import record_requests
 from bbdc_slot_finder import BbdcApi, UserSession
 from bbdc_bot.logger import logger
 from datetime import datetime
@@ -35,7 +34,7 @@ async def open_browser(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     if hasattr(session, "_browser"):
         await session.close_browser()
 
-    await session.init_playwright_browser(headless=False)
+    await session.init_playwright_browser(headless=False, scan_only=False)
 
     return True
 
@@ -0,0 +1,153 @@
+"""
+Scheduling policy for camping jobs.
+
+Slots tend to appear in bursts (cancellations before the try-sell cut-off,
+scheduled releases). A user can list time-of-day release windows in the
+`camp` section of their config.yaml; inside a window the camper scans at the
+burst interval, outside it at the normal /camp interval. All jobs that are
+inside a window share a global burst budget (scans per minute), so the burst
+interval of each job stretches when many users burst at once.
+
+The interval of a running job is changed in place (the APScheduler trigger is
+swapped), so neither the job nor the user's browser page is recreated.
+"""
+import datetime
+from bbdc_bot.logger import logger
+
+MIN_INTERVAL = 30  # seconds, outside release windows
+MIN_BURST_INTERVAL = 5  # seconds, inside release windows
+
+
+class ReleaseWindow(object):
+    def __init__(self, start: datetime.time, end: datetime.time):
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def parse(cls, text):
+        """From "HH:MM-HH:MM"; the window may wrap around midnight."""
+        start, end = (
+            datetime.datetime.strptime(i.strip(), "%H:%M").time()
+            for i in text.split("-")
+        )
+        return cls(start, end)
+
+    def __str__(self):
+        return f"{self.start:%H:%M}-{self.end:%H:%M}"
+
+    def contains(self, now: datetime.datetime) -> bool:
+        t = now.time()
+        if self.start <= self.end:
+            return self.start <= t < self.end
+        return t >= self.start or t < self.end
+
+    def seconds_until_start(self, now: datetime.datetime) -> float:
+        start = datetime.datetime.combine(now.date(), self.start)
+        if start <= now:
+            start += datetime.timedelta(days=1)
+        return (start - now).total_seconds()
+
+
+class BurstBudget(object):
+    def __init__(self, scans_per_minute=12):
+        """
+        Args:
+            scans_per_minute (float): scans per minute shared by all jobs that
+                are inside a release window.
+        """
+        self.scans_per_minute = scans_per_minute
+        self._bursting = set()
+
+    def __len__(self):
+        return len(self._bursting)
+
+    def enter(self, name):
+        self._bursting.add(name)
+
+    def leave(self, name):
+        self._bursting.discard(name)
+
+    def interval(self, burst_interval) -> float:
+        """Burst interval of one job given how many jobs are bursting."""
+        shared = 60 * max(len(self._bursting), 1) / self.scans_per_minute
+        return max(burst_interval, shared, MIN_BURST_INTERVAL)
+
+
+_budget = None
+
+
+def configure_burst_budget(**kwargs) -> BurstBudget:
+    """Replace the process-wide budget, e.g. from the `camp` bot config."""
+    global _budget
+    _budget = BurstBudget(**kwargs)
+    return _budget
+
+
+def get_burst_budget() -> BurstBudget:
+    global _budget
+    if _budget is None:
+        _budget = BurstBudget()
+    return _budget
+
+
+class CampSchedule(object):
+    def __init__(self, interval, windows=(), burst_interval=10):
+        """
+        Args:
+            interval (float): seconds between scans outside the windows
+            windows (list): "HH:MM-HH:MM" release windows, local time
+            burst_interval (float): seconds between scans inside a window,
+                before the global budget is applied
+        """
+        self.interval = max(float(interval), MIN_INTERVAL)
+        self.windows = [ReleaseWindow.parse(w) for w in windows]
+        self.burst_interval = max(float(burst_interval), MIN_BURST_INTERVAL)
+
+    @classmethod
+    def from_config(cls, interval, config):
+        camp = config.get("camp") or {}
+        return cls(
+            interval,
+            windows=camp.get("windows", []),
+            burst_interval=camp.get("burst_interval", 10),
+        )
+
+    def in_window(self, now=None) -> bool:
+        now = now or datetime.datetime.now()
+        return any(w.contains(now) for w in self.windows)
+
+    def next_delay(self, name, now=None):
+        """
+        Returns:
+            (interval, delay): the period the job should run at from now on,
+            and the delay to its next run, which is shorter than the period
+            if a release window opens before then.
+        """
+        now = now or datetime.datetime.now()
+        budget = get_burst_budget()
+        if self.in_window(now):
+            budget.enter(name)
+            interval = budget.interval(self.burst_interval)
+            return interval, interval
+        budget.leave(name)
+        delay = self.interval
+        for window in self.windows:
+            delay = min(delay, window.seconds_until_start(now))
+        return self.interval, max(delay, MIN_BURST_INTERVAL)
+
+
+def apply_schedule(job, schedule: CampSchedule, now=None):
+    """Retime a running repeating job in place from its CampSchedule."""
+    interval, delay = schedule.next_delay(job.name, now)
+    aps_job = job.job
+    trigger = aps_job.trigger
+    if trigger.interval.total_seconds() != interval:
+        aps_job.reschedule("interval", seconds=interval, end_date=trigger.end_date)
+        logger.info(f"camping job {job.name}: every {interval:.0f}s")
+    if delay < interval:
+        next_run = datetime.datetime.now(trigger.timezone) + datetime.timedelta(
+            seconds=delay
+        )
+        if aps_job.next_run_time is None or next_run < aps_job.next_run_time:
+            aps_job.modify(next_run_time=next_run)
+    return interval
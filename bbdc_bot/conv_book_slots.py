@@ -1,7 +1,7 @@
 from bbdc_slot_finder.api import UserSession, BbdcApi
-from bbdc_slot_finder.async_playwright_browser_ops import select_slots, book_slots
+from bbdc_slot_finder.slot_store import SlotStore
 from bbdc_bot.logger import logger
-import os, json, asyncio, datetime
+import os, json, asyncio
 from telegram.ext import (
     CommandHandler,
     ContextTypes,
@@ -16,7 +16,7 @@ from telegram import (
     Update,
     ForceReply,
 )
-import time
+from bbdc_slot_finder.event_loop import append_to_file
 from telegram.constants import ParseMode
 
 CONFIRM, CANCEL_BOOKING, CHOOSING = 3001, 3102, 3103
@@ -25,14 +25,14 @@ TOTAL_VOTER_COUNT = 1
 
 DEBUG = os.environ.get("BBDC_BOT_DEBUG", False)
 
-"""
+
 def get_debug_slots_list():
     with open("json-server/api-data/POST.json", "r") as f:
         reqs = json.load(f)
     data = reqs["bbdc-back-service-api-booking-c3practical-listC3PracticalSlotReleased"]
     slots_list = BbdcApi.parse_released_slots(data["data"])
     return slots_list
-"""
+
 
 # /start
 async def start_booking(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -71,14 +71,14 @@ async def start_booking(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             .get("auto_captcha", True),
         }
         msg += (
-            f"{datetime.datetime.strptime(slots_data[i]['slot_date'], '%Y-%m-%d').strftime('%m/%d %a')}, "
-            f"S{slots_data[i]['session']} at {slots_data[i]['start_time']}, "
-            f"${slots_data[i]['total_fee']}"
+            f"{slots_data[i].day.strftime('%m/%d %a')}, "
+            f"S{slots_data[i].session} at {slots_data[i].start_time}, "
+            f"${slots_data[i].total_fee}"
         )
         logger.info(msg)
         message = await update.effective_message.reply_text(msg)
-        await api_preprocess_booking(update, context)
-        return ConversationHandler.END
+        # CAPTCHA if the captcha is to be solved by hand
+        return await api_preprocess_booking(update, context)
     else:
         context.chat_data["book"] = {
             "slots": set(),
@@ -106,19 +106,18 @@ async def list_slots_to_book(update, context):
             else:
                 chosen_slots.update([query.data])
     choices_short = lambda i: (
-        f"{datetime.datetime.strptime(slots_list[i]['slot_date'], '%Y-%m-%d').strftime('%m/%d,%a')}"
-        f",S{slots_list[i]['session']}"
+        f"{slots_list[i].day.strftime('%m/%d,%a')},S{slots_list[i].session}"
     )
     choices_long = lambda i: (
-        f"{datetime.datetime.strptime(slots_list[i]['slot_date'], '%Y-%m-%d').strftime('%m/%d-%a')}"
-        f",S{slots_list[i]['session']}-{slots_list[i]['start_time']},"
-        f"${slots_list[i]['total_fee']}"
+        f"{slots_list[i].day.strftime('%m/%d-%a')}"
+        f",S{slots_list[i].session}-{slots_list[i].start_time},"
+        f"${slots_list[i].total_fee}"
     )
     keys = [
         InlineKeyboardButton(
             ("*" if i in chosen_slots else "") + choices_short(i), callback_data=str(i)
         )
-        for i in sorted(slots_list)
+        for i in slots_list  # the store iterates in date order
     ] + [InlineKeyboardButton("All", callback_data="000000000-0000000")]
 
     keyboard = [keys[i : i + 2] for i in range(0, len(keys), 2)] + [
@@ -173,7 +172,9 @@ async def handle_booking_confirmation(
             return ConversationHandler.END
         if isinstance(book["slots"], set):
             slots_data = context.chat_data["config"].released_slots
-            book["slots"] = {k: slots_data[k] for k in book["slots"]}
+            book["slots"] = SlotStore(
+                (k, slots_data[k]) for k in book["slots"] if k in slots_data
+            )
         logger.info("Booking request confirmed.")
         text = query.message.text_html
         await query.edit_message_text(text=text + "\nGot it.", parse_mode="HTML")
@@ -184,43 +185,56 @@ async def handle_booking_confirmation(
 
 
 async def browser_book(update, context):
+    from bbdc_slot_finder.async_playwright_browser_ops import select_slots, book_slots
+
     book: dict = context.chat_data["book"]
     config: UserSession = context.chat_data["config"]
     session: BbdcApi = context.chat_data.get("client", {})
-    slots_data: dict = book["slots"]
+    slots_data: SlotStore = book["slots"]
     chat_id: int = context._chat_id
 
+    if not hasattr(session, "_browser_page"):
+        # scanning over HTTP does not keep a page open
+        await session.init_playwright_browser(scan_only=False)
     page = session._browser_page
+    await session.use_booking_profile()
     msg = f"Autobooking slots. Selecting slots..."
     message = await context.bot.send_message(chat_id=chat_id, text=msg)
-    if book["all"]:
-        success_flag = await select_slots(page, slots_data, select_all=True)
-    else:
-        success_flag = await select_slots(page, slots_data)
-    await message.edit_text(text=f"{msg}: {success_flag}")
-    if success_flag:
-        counter = 1
-        while counter <= 3:
-            sucess, data = await book_slots(page)
-            msg = "Finished! " if sucess else "Failed. "
-            if not sucess:
-                msg += data
-            else:
-                for slot in data["bookedPracticalSlotList"]:
-                    msg += f'{slot["slotRefDate"]} {slot["slotRefName"]}: {slot["startTime"]}-{slot["endTime"]}\n'
-                    msg += (
-                        "Success!" if slot["success"] else f'Failed: {slot["message"]}'
+    # months still being scanned must not click on the page meanwhile
+    async with session._page_lock:
+        if book["all"]:
+            success_flag = await select_slots(page, slots_data, select_all=True)
+        else:
+            success_flag = await select_slots(page, slots_data)
+        await message.edit_text(text=f"{msg}: {success_flag}")
+        if success_flag:
+            counter = 1
+            pipelined = bool(config["autobook"].get("pipeline", False))
+            while counter <= 3:
+                sucess, data = await book_slots(page, pipelined=pipelined)
+                msg = "Finished! " if sucess else "Failed. "
+                if not sucess:
+                    msg += data
+                else:
+                    for slot in data["bookedPracticalSlotList"]:
+                        msg += f'{slot["slotRefDate"]} {slot["slotRefName"]}: {slot["startTime"]}-{slot["endTime"]}\n'
+                        msg += (
+                            "Success!"
+                            if slot["success"]
+                            else f'Failed: {slot["message"]}'
+                        )
+                        msg += "\n"
+                    context.chat_data["book"].clear()
+                await message.edit_text(msg)
+                await asyncio.sleep(5)
+                if (not sucess) and ("Incorrect Captcha" in msg):
+                    msg = "Attempting again..."
+                    message = await context.bot.send_message(
+                        chat_id=chat_id, text=msg
                     )
-                    msg += "\n"
-                context.chat_data["book"].clear()
-            await message.edit_text(msg)
-            time.sleep(5)
-            if (not sucess) and ("Incorrect Captcha" in msg):
-                msg = "Attempting again..."
-                message = await context.bot.send_message(chat_id=chat_id, text=msg)
-                counter += 1
-            else:
-                return ConversationHandler.END
+                    counter += 1
+                else:
+                    return ConversationHandler.END
 
 
 async def api_preprocess_booking(update, context):
@@ -230,7 +244,7 @@ async def api_preprocess_booking(update, context):
     book: dict = context.chat_data["book"]
     config: UserSession = context.chat_data["config"]
     session: BbdcApi = context.chat_data.get("client", {})
-    slots_data: dict = book["slots"]
+    slots_data: SlotStore = book["slots"]
     chat_id: int = context._chat_id
     if DEBUG and not context.chat_data.get("config", False):
         # if not DEBUG: there should already have config
@@ -239,6 +253,18 @@ async def api_preprocess_booking(update, context):
     msg: str = f"Processing booking... Auto-mode={book['auto']}"
     logger.info(msg)
     message = await context.bot.send_message(chat_id=chat_id, text=msg)
+    if not isinstance(slots_data, SlotStore):
+        slots_data = book["slots"] = SlotStore(slots_data)
+    await session.init_scan_client()
+    # slots seen through another user's scan carry no booking tokens
+    failed = await session.refresh_booking_tokens(slots_data)
+    if failed:
+        msg = f"Could not refresh slots of {', '.join(failed)}, skipped."
+        logger.warning(msg)
+        await context.bot.send_message(chat_id=chat_id, text=msg)
+    if not len(slots_data):
+        await message.edit_text("No slots to book...")
+        return ConversationHandler.END
 
     if config["autobook"].get("safe_mode", True):  # manual standard process
         # not auto-book: check availability again
@@ -249,9 +275,9 @@ async def api_preprocess_booking(update, context):
         total_items: int = len(slots_data)
         slots_to_book: list = await session.api_update_clash_status(slots_data)
         encryptslotlist = [
-            slots_data[i]["payload"]
+            slots_data[i].payload
             for i in slots_data
-            if slots_data[i]["slot_id"] in slots_to_book
+            if slots_data[i].slot_id in slots_to_book
         ]
         confirmed_slots = len(slots_to_book)
         msg += f"({confirmed_slots:d}/{total_items})"
@@ -261,9 +287,9 @@ async def api_preprocess_booking(update, context):
         # not check for clashed status
         await message.edit_text("Skip updating clash status")
         encryptslotlist = [
-            slots_data[i]["payload"] for i in slots_data
+            slots_data[i].payload for i in slots_data
         ]  # [{...}, {...}]
-        slots_to_book = [slots_data[i]["slot_id"] for i in slots_data]  # [id1, id2,...]
+        slots_to_book = [slots_data[i].slot_id for i in slots_data]  # [id1, id2,...]
 
     if slots_to_book:
         book_payload = {
@@ -295,6 +321,7 @@ async def api_request_for_captcha(update, context):
         img, captcha_json = await session.get_booking_captcha_image(book_data["auto"])
     except Exception as e:
         logger.info(f"Error: {e}")
+        await context.bot.send_message(chat_id=chat_id, text=f"Booking stopped: {e}")
         return ConversationHandler.END
     context.chat_data["book"]["payload"].update(captcha_json)
     if not book_data["auto"]:
@@ -361,8 +388,7 @@ async def send_book_requests(update: Update, context: ContextTypes.DEFAULT_TYPE)
         if "Incorrect Captcha" in res and book["counter"] < 2:
             if not book["auto"]:
                 await context.chat_data["book"]["captcha_photo"].delete()
-                message_msg = context.chat_data["book"]["captcha_msg"]
-                await message_msg.edit_text(f"{res}. Please try again.")
+                await message.edit_text(f"{res}. Please try again.")
             else:
                 await message.edit_text(text=f"{res}. Attempting again...")
             await asyncio.sleep(2)
@@ -370,8 +396,7 @@ async def send_book_requests(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return CAPTCHA
 
         else:
-            with open("logs/log.json", "a+") as f:
-                json.dump(res, f)
+            await append_to_file("logs/log.json", json.dumps(res))
     await context.bot.send_message(chat_id=chat_id, text=f"Booking unsuccessful: {res}")
     return ConversationHandler.END
 
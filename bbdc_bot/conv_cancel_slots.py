@@ -151,6 +151,7 @@ async def process_canceling(update, context):
     await query.answer()
     i = query.data
     slotid, slot_type = slots_list[i]["bookingId"], slots_list[i]["dataType"]
+    await session.init_scan_client()
     msg = await session.cancel_slot(slotid, slot_type)
 
     await query.edit_message_text(f"{msg}")
@@ -15,6 +15,7 @@ from telegram.ext import (
 
 from bbdc_bot.logger import logger
 from bbdc_slot_finder.api import UserSession, BbdcApi
+from bbdc_slot_finder.event_loop import run_blocking
 import json, datetime
 from dateutil.relativedelta import relativedelta
 
@@ -57,6 +58,7 @@ async def set_config(update, context):
 
     text = "Client status: \n"
     text += f"Stopped: {session.stop}\n"
+    text += f"HTTP client: {session._httpx_client is not None}\n"
     text += f"Browser running: {hasattr(session, '_browser')}\n"
     text += f"Browser page: {hasattr(session, '_browser_page')}\n"
     if hasattr(session, "_browser_page"):
@@ -240,7 +242,7 @@ async def save_config(update, context):
     query = update.callback_query
     if query:
         await query.answer()
-    context.chat_data["config"].save()
+    await run_blocking(context.chat_data["config"].save)
     if query:
         await query.edit_message_text(f"Configuration saved. ")
     logger.debug("trigger save_config")
@@ -1,5 +1,18 @@
 from bbdc_slot_finder.api import UserSession, BbdcApi
 from bbdc_slot_finder.exceptions import TokenExpireError, NameError, SessionStopError
-from bbdc_slot_finder.auto_decoder import auto_solve_captcha_data, get_captcha_image
 from bbdc_slot_finder.config import load_config
-from bbdc_slot_finder.async_playwright_browser_ops import start_browser
+
+# the captcha (numpy/PIL/OCR) and playwright stacks are imported on first use
+_LAZY_ATTRS = {
+    "auto_solve_captcha_data": "bbdc_slot_finder.auto_decoder",
+    "get_captcha_image": "bbdc_slot_finder.auto_decoder",
+    "start_browser": "bbdc_slot_finder.async_playwright_browser_ops",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        import importlib
+
+        return getattr(importlib.import_module(_LAZY_ATTRS[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,21 +1,42 @@
 import datetime, pathlib
 from bbdc_slot_finder.logger import logger
 from telegram.ext import ContextTypes
-from bbdc_slot_finder.auto_decoder import get_captcha_image, auto_solve_captcha_data
 from bbdc_slot_finder.exceptions import NameError, SessionStopError, TokenExpireError
 from bbdc_slot_finder.config import load_config, write_config
 from bbdc_slot_finder.const import *
-from random import random
+from bbdc_slot_finder.event_loop import append_to_file, run_blocking
+from bbdc_slot_finder.pacing import get_pacer
+from bbdc_slot_finder.slot_diff import SlotDiff
+from bbdc_slot_finder.slots import parse_released_slots
 import json, time, os
 import asyncio
 from typing import Optional, Dict
-from bbdc_slot_finder.async_playwright_browser_ops import (
-    async_playwright,
-    build_bbdc_browser,
-    list_c3_slot_released as browser_check_slot,
-)
 
 DEBUG = os.environ.get("BBDC_BOT_DEBUG", False)
+# "http": scan and list bookings with a plain HTTP client (see http_client),
+# the browser is only opened to log in and book; "browser": use a page for all
+SCAN_BACKEND = os.environ.get("BBDC_SCAN_BACKEND", "http")
+# "api": post listC3PracticalSlotReleased directly, clicking through the page
+# only if that fails; "page": always click the month buttons
+SCAN_MODE = os.environ.get("BBDC_SCAN_MODE", "api")
+# consecutive failed direct requests before a session sticks to the page
+MAX_API_SCAN_FAILURES = 3
+# months fetched at once by scan_slots, and the jitter scale of their requests
+# (None: the pacing default); overridden by the `scan` section of the user config
+SCAN_CONCURRENCY = 1
+SCAN_JITTER = None
+# body of listC3PracticalSlotReleased until the page has sent one itself
+LIST_SLOT_PAYLOAD = {
+    "courseType": "3C",
+    "insInstructorId": "",
+    "stageSubDesc": "Practical Lesson",
+    "subVehicleType": None,
+    "subStageSubNo": None,
+}
+# flags of a slot in an updateSlotListClashStatus response that rule it out
+CLASH_FIELDS = ["clash", "isClash"]
+# captcha images requested before an automatic booking gives up on OCR
+MAX_CAPTCHA_ATTEMPTS = 3
 # from browser_login import login
 
 if DEBUG:
@@ -86,7 +107,9 @@ class UserSession(dict):
             self._client = None
             # self._client = BbdcApi(self.headers, self.stored_cookies)
             self.scheduled = None
-            self.released_slots = {}
+            # released_slots is the merged view kept up to date by slot_diff
+            self.slot_diff = SlotDiff()
+            self.released_slots = self.slot_diff.slots
         else:
             raise NameError()
 
@@ -116,71 +139,131 @@ class BbdcApi(object):
         self.user_session = user_session
         user_session._client = self
         self.stop = None
+        self._scan_payload = None
+        self._api_scan_failures = 0
+        self._httpx_client = None
+        self._captcha = None  # (captcha_key, answer) of the last solved captcha
+        # the page can only click through one month at a time
+        self._page_lock = asyncio.Lock()
+        self.pacer = get_pacer(user_session.chat_id)
 
     def _update_auth(self, force_update=False):
         # if self.stop=None or False (not stopped), or if force to update
         if (not self.stop) or force_update:
             if getattr(self, "_httpx_client", False):
                 self.init_httpx_client()
-            else:
-                # if force update, reset stop sign
-                self.stop = False
+            # if force update, reset stop sign
+            self.stop = False
+        if force_update:
+            self._api_scan_failures = 0
 
     async def close_browser(self, stop=False):
-        if hasattr(self, "_stopped"):
-            # in case the process is triggered repeatedly via hooks
-            del self._stopped
-            return
+        """Hand the page back to the warm pool; with stop, the login is no
+        longer valid and the user's pooled pages are closed as well."""
         if stop:
             self.stop = stop
         logger.info("browser closing..")
         if getattr(self, "_browser", False):
+            from bbdc_slot_finder.browser_manager import get_browser_manager
+
+            context = self._browser
+            context.remove_listener("close", self._on_browser_closed)
+            context.remove_listener("request", self._capture_scan_payload)
+            del self._browser
+            del self._browser_page
+            del self._browser_client
             if DEBUG:
-                await self._browser.tracing.stop(path="trace.zip")
+                try:
+                    await context.tracing.stop(path="trace.zip")
+                except:
+                    pass
+            await get_browser_manager().release(context, discard=bool(self.stop))
+
+    def _capture_scan_payload(self, request):
+        # reuse the SPA's own request body for direct scans
+        if "listC3PracticalSlotReleased" in request.url:
             try:
-                self._stopped = True
-                await self._browser.close()
-                await self._browser.browser.close()
-                await self._browser_playwright.stop()
-            except:
+                self._scan_payload = request.post_data_json
+            except Exception:
                 pass
-            finally:
-                if getattr(self, "_browser", False):
-                    del self._browser
-                    del self._browser_page
-                    del self._browser_client
-                    del self._browser_playwright
-
-    async def init_playwright_browser(self, headless=None):
+
+    def _on_browser_closed(self, context):
+        # context closed underneath the session (e.g. chromium crashed): drop
+        # the handles so the next run opens a new page
+        if getattr(self, "_browser", None) is context:
+            logger.warning("browser closed unexpectedly")
+            del self._browser
+            del self._browser_page
+            del self._browser_client
+
+    def init_httpx_client(self):
+        """(Re)authenticate the HTTP client from the user's saved login."""
+        from bbdc_slot_finder.http_client import BbdcHttpClient
+
+        user_session = self.user_session
+        if self._httpx_client is None:
+            self._httpx_client = BbdcHttpClient(
+                user_session.headers, user_session.stored_cookies
+            )
+        else:
+            self._httpx_client.update_auth(
+                user_session.headers, user_session.stored_cookies
+            )
+        return self._httpx_client
+
+    async def init_scan_client(self, headless=None):
+        """Get ready to scan: the HTTP client, or a page with BBDC_SCAN_BACKEND=browser."""
+        if self.stop:
+            raise SessionStopError()
+        if SCAN_BACKEND == "http":
+            if self._httpx_client is None:
+                logger.info("init http client")
+                self.init_httpx_client()
+        elif not hasattr(self, "_browser_page"):
+            await self.init_playwright_browser(headless=headless)
+
+    @property
+    def _request_client(self):
+        # the HTTP client if there is one, else the page's request context
+        if self._httpx_client is not None:
+            return self._httpx_client
+        return self._browser_client
+
+    async def init_playwright_browser(self, headless=None, scan_only=True):
         if self.stop:
             # if the session was closed due to TokenExpireError and has not been re-authorized
             raise SessionStopError()
+        from bbdc_slot_finder.browser_manager import get_browser_manager
+
         logger.info("init browser")
         self.stop = False
         if headless is None:
             headless = not (bool(DEBUG))
-        self._browser_playwright = await async_playwright().start()
-        self._browser, self._browser_page = await build_bbdc_browser(
-            self._browser_playwright,
-            debug=DEBUG,
+        self._browser, self._browser_page = await get_browser_manager().acquire(
+            f"user/{self.user_session.chat_id}",
             headless=headless,
-            directory=f"user/{self.user_session.chat_id}",
-            refresh_token=False,
-        )
-        await self._browser_page.goto(
-            "https://booking.bbdc.sg/?#/booking/chooseSlot?courseType=3C&insInstructorId=&instructorType="
+            debug=DEBUG,
+            scan_only=scan_only,
         )
         self._browser_client = self._browser_page.request
-        self._browser.on("close", self.close_browser)
+        self._browser.on("close", self._on_browser_closed)
+        self._browser.on("request", self._capture_scan_payload)
         if DEBUG:
             await self._browser.tracing.start(
                 screenshots=False, snapshots=True, sources=True
             )
         return
 
+    async def use_booking_profile(self):
+        """Stop blocking images, fonts etc. on the page before booking with it."""
+        if getattr(self, "_browser", False):
+            from bbdc_slot_finder.browser_manager import get_browser_manager
+
+            await get_browser_manager().full_fidelity(self._browser)
+
     async def _post_request(
         self, endpoint: str, payload: dict = None, sleep: float = 1
-    ):  # post request from playwright
+    ):  # post request; not paced (only scan fetches wait for the pacer)
         if self.stop:
             print("session stopped. do not post request.")
             self.close_browser(stop=True)
@@ -191,19 +274,22 @@ class BbdcApi(object):
         try:
             await asyncio.sleep(sleep)  # sleep
             # 发送POST请求
-            response = await self._browser_client.post(
+            response = await self._request_client.post(
                 url, headers=self.user_session.headers, data=payload
             )
             return response
             # logger.info(f"Request successful: {response.json()}")
         except Exception as e:
-            print(f"An unexpected error occurred during: {e}")
-            try:
-                with open("logs/log.json", "a+") as f:
-                    f.write(f"{datetime.datetime.now()} - {response.text}\n")
-            except:
-                pass
-            await self.close_client(stop=True)  # force close
+            import httpx
+
+            logger.error(f"An unexpected error occurred during {endpoint}: {e}")
+            await append_to_file(
+                "logs/log.json", f"{datetime.datetime.now()} - {endpoint}: {e!r}\n"
+            )
+            if not isinstance(e, (httpx.HTTPStatusError, httpx.TransportError)):
+                # a server error or a dropped connection says nothing about
+                # the login; the session stays usable
+                await self.close_client(stop=True)  # force close
             raise (e)
 
     @staticmethod
@@ -213,16 +299,23 @@ class BbdcApi(object):
             return True, res[key]
         else:
             logger.warning("failed request")
-            with open("logs/log.json", "a+") as f:
-                text = await response.text()
-                f.write(f"{datetime.datetime.now()} - {response.url}: {text}\n")
+            text = await response.text()
+            await append_to_file(
+                "logs/log.json", f"{datetime.datetime.now()} - {response.url}: {text}\n"
+            )
             logger.info(res["message"])
             return False, res["message"]
 
     async def close_client(self, stop=False):
+        from bbdc_slot_finder.scan_coordinator import get_scan_coordinator
+
         self.stop = stop
+        get_scan_coordinator().unsubscribe(self.user_session.chat_id)
         if hasattr(self, "_browser"):
             await self.close_browser(stop=stop)
+        if self._httpx_client is not None:
+            client, self._httpx_client = self._httpx_client, None
+            await client.aclose()
 
     @staticmethod
     def parse_available_month(data, request_month, current_month) -> list:
@@ -245,47 +338,17 @@ class BbdcApi(object):
         ]
         return avail_months_list
 
-    @staticmethod
-    def parse_released_slots(data: dict) -> dict:
-        """Parse released slots data and return a dictionary of parsed slot information.
+    parse_released_slots = staticmethod(parse_released_slots)
 
-        Args:
-            data (dict): A dictionary containing released slot data.
+    @staticmethod
+    def _save_schedule(chat_id, active_booking_list):
+        # schedule.json and the calendar file sent by /myschedule
+        from bbdc_bot.cal import schedule_to_ics
 
-        Returns:
-            dict: A dictionary containing parsed slot information with slot keys and corresponding details.
-        """
-        if not data:
-            return
-        slot_list = {}
-        slot_data = data["releasedSlotListGroupByDay"]
-        if slot_data is None:
-            return slot_list
-        for day, slots in slot_data.items():
-            date = datetime.datetime.fromisoformat(day).strftime("%Y%m%d")
-            for slot in slots:
-                slotDate_code = date + slot["slotRefName"].split(" ")[1]
-                # slotDate_code = date + slot["slotRefName"].split(" ")[1]  # %Y%m%d\d-\d+
-                slot_key = f"{slotDate_code}-{slot['slotId']}"
-                slot_list.update(
-                    {
-                        slot_key: {
-                            "payload": {
-                                "slotIdEnc": slot["slotIdEnc"],
-                                "bookingProgressEnc": slot["bookingProgressEnc"],
-                            },
-                            "slot_id": int(slot["slotId"]),
-                            "total_fee": slot["totalFee"],
-                            "slots_code": f"{slotDate_code}-{slot['slotId']}",
-                            "slot_date": day[:10],
-                            "group": slot["c3PsrFixGrpNo"],
-                            "session": slot["slotRefName"].split(" ")[1],
-                            "start_time": slot["startTime"],
-                            "end_time": slot["endTime"],
-                        }
-                    }
-                )
-        return slot_list
+        with open(f"user/{chat_id}/schedule.json", "w") as f:
+            json.dump(active_booking_list, f)
+        with open(f"user/{chat_id}/bbdc.ics", "wb") as f:
+            f.write(schedule_to_ics(active_booking_list))
 
     async def list_scheduled(self):
         user_session = self.user_session
@@ -297,13 +360,10 @@ class BbdcApi(object):
 
         suc, res = await self.handle_response(response)
         if suc is True:
-            from bbdc_bot.cal import schedule_to_ics
-
             active_booking_list = res["theoryActiveBookingList"]
-            with open(f"user/{user_session.chat_id}/schedule.json", "w") as f:
-                json.dump(active_booking_list, f)
-            with open(f"user/{user_session.chat_id}/bbdc.ics", "wb") as f:
-                f.write(schedule_to_ics(active_booking_list))
+            await run_blocking(
+                self._save_schedule, user_session.chat_id, active_booking_list
+            )
             user_session.scheduled = {
                 (
                     datetime.datetime.strptime(
@@ -320,22 +380,375 @@ class BbdcApi(object):
             await self.close_client(stop=True)
             raise Exception("Unknwon error: failed network request")
 
-    async def list_c3_slot_released(self, month=None):
+    async def _booking_request(self, endpoint, payload, sleep=0):
+        # booking races other users: never wait for (or feed) the scan pacer
+        return await self._post_request(endpoint, payload=payload, sleep=sleep)
+
+    async def _fetch_booking_tokens(self, month):
+        """One month for this account, unpaced and without touching the
+        session on failure; (success, data)."""
+        from bbdc_slot_finder.async_playwright_browser_ops import (
+            api_list_c3_slot_released,
+        )
+
+        payload = self._scan_payload or dict(
+            LIST_SLOT_PAYLOAD, courseType=self.user_session.profile["courseType"]
+        )
+        try:
+            return await api_list_c3_slot_released(
+                self._request_client, self.user_session.headers, payload, month
+            )
+        except Exception as e:
+            logger.warning(f"failed to fetch {month} for booking tokens: {e!r}")
+            return False, {}
+
+    async def refresh_booking_tokens(self, slots) -> list:
+        """
+        Fetch again, for this account, the months of slots that came from
+        another user's scan and so have no booking tokens (see
+        scan_coordinator). Slots taken meanwhile are dropped from `slots`;
+        so are the slots of a month that could not be fetched.
+        Args:
+            slots (SlotStore): the slots about to be booked, updated in place
+        Returns:
+            list of months that could not be fetched
+        """
+        released = self.user_session.released_slots
+        months = {slots[k].month for k in slots if slots[k].slot_id_enc is None}
+        failed = []
+        for m in sorted(months):
+            logger.info(f"fetching {m} again for booking tokens")
+            suc, data = await self._fetch_booking_tokens(m)
+            if not suc:
+                failed.append(m)
+                for key in slots.keys_in_month(m):
+                    del slots[key]
+                continue
+            fresh = self.parse_released_slots(data)
+            for key in slots.keys_in_month(m):
+                if key in (fresh or {}):
+                    slots[key] = fresh[key]
+                    if key in released:
+                        released[key] = fresh[key]
+                else:
+                    del slots[key]
+                    released.pop(key, None)
+        return failed
+
+    @staticmethod
+    def parse_clash_status(data, slot_ids) -> list:
+        """
+        Slot ids of an updateSlotListClashStatus response that can be booked:
+        those with a per-slot record (a dict with slotId) not flagged as
+        clashing. A reply without such records is logged and nothing counts
+        as bookable, so an unexpected reply never skips the check.
+        """
+        records = data
+        if isinstance(data, dict):
+            records = next((v for v in data.values() if isinstance(v, list)), [])
+        records = [
+            i for i in records or [] if isinstance(i, dict) and "slotId" in i
+        ]
+        if not records:
+            logger.warning(f"unrecognised clash status reply: {data!r}")
+            return []
+        listed = {int(i["slotId"]) for i in records}
+        clashed = {
+            int(i["slotId"]) for i in records if any(i.get(f) for f in CLASH_FIELDS)
+        }
+        return [i for i in slot_ids if i in listed and i not in clashed]
+
+    async def api_update_clash_status(self, slots) -> list:
+        """
+        Ask the server which of the slots are still free and do not clash
+        with the account's bookings.
+        Args:
+            slots (SlotStore): slots to book
+        Returns:
+            list of slot ids that can be booked
+        """
+        slot_ids = [slots[k].slot_id for k in slots]
+        response = await self._booking_request(
+            booking_updateSlotListClashStatus,
+            payload={
+                "courseType": self.user_session.profile["courseType"],
+                "slotIdList": slot_ids,
+                "encryptSlotList": [slots[k].payload for k in slots],
+            },
+        )
+        suc, res = await self.handle_response(response)
+        if not suc:
+            logger.warning(f"clash status not updated: {res}")
+            return []
+        return self.parse_clash_status(res, slot_ids)
+
+    async def get_booking_captcha_image(self, auto=False):
+        """
+        Request a booking captcha; with auto, solve it in the captcha service
+        (a new image is requested while OCR gives no 5-character answer).
+        Returns:
+            (img, captcha_json): the image bytes, and the captcha fields of
+            the booking payload, with verifyCodeValue filled in if auto.
+        Raises:
+            Exception: with auto, no 5-character answer after
+                MAX_CAPTCHA_ATTEMPTS images
+        """
+        import base64
+        from bbdc_slot_finder.captcha_cache import captcha_key
+        from bbdc_slot_finder.captcha_service import get_captcha_service
+
+        self._captcha = None
+        for attempt in range(MAX_CAPTCHA_ATTEMPTS if auto else 1):
+            response = await self._booking_request(
+                booking_getCaptchaImage, {}, sleep=2 if attempt else 0
+            )
+            suc, data = await self.handle_response(response)
+            if not suc:
+                raise Exception(f"failed to get captcha: {data}")
+            captcha_json = {
+                k: v for k, v in data.items() if k != "image"
+            }  # captchaToken, verifyCodeId
+            img = base64.b64decode(data["image"].split(",")[-1])
+            if not auto:
+                return img, captcha_json
+            try:
+                captcha = await get_captcha_service().solve(data)
+            except Exception as e:
+                logger.warning(f"captcha solve failed: {e!r}")
+                captcha = ""
+            if len(captcha) == 5:
+                break
+        else:
+            # a wrong answer would waste the booking attempt
+            raise Exception(
+                f"captcha not solved after {MAX_CAPTCHA_ATTEMPTS} attempts"
+            )
+        self._captcha = (captcha_key(data), captcha)
+        captcha_json["verifyCodeValue"] = captcha
+        return img, captcha_json
+
+    async def book_slots(self, payload, sleep=0):
+        """
+        Book with callBookC3PracticalSlot; payload as built by
+        api_preprocess_booking plus the captcha fields.
+        Returns:
+            (success, res): the booking data if successful, else the message
+        """
+        from bbdc_slot_finder.captcha_service import get_captcha_service
+
+        response = await self._booking_request(
+            booking_callBookC3PracticalSlot, payload, sleep=sleep
+        )
+        suc, res = await self.handle_response(response)
+        # report the verdict on an automatically solved captcha
+        if self._captcha and payload.get("verifyCodeValue") == self._captcha[1]:
+            if suc:
+                get_captcha_service().report(self._captcha[0], True)
+            elif "Incorrect Captcha" in str(res):
+                get_captcha_service().report(self._captcha[0], False)
+            self._captcha = None
+        if suc:
+            booked = {
+                int(i["slotId"])
+                for i in res.get("bookedPracticalSlotList", [])
+                if i.get("success") and "slotId" in i
+            }
+            released = self.user_session.released_slots
+            for key in [k for k in released if released[k].slot_id in booked]:
+                del released[key]
+        return suc, res
+
+    async def cancel_slot(self, slotid, slot_type) -> str:
+        """
+        Cancel a booking listed by list_scheduled.
+        Args:
+            slotid: bookingId of the booking
+            slot_type: its dataType
+        Returns:
+            message for the user
+        """
+        response = await self._booking_request(
+            booking_manage_cancelBooking,
+            payload={"bookingId": slotid, "dataType": slot_type},
+        )
+        suc, res = await self.handle_response(response, key="message")
+        if not suc:
+            return f"Cancel failed: {res}"
+        scheduled = self.user_session.scheduled or {}
+        for key in [k for k, v in scheduled.items() if v["bookingId"] == slotid]:
+            del scheduled[key]
+        return f"Cancelled. {res or ''}".strip()
+
+    async def list_c3_slot_released(self, month=None, jitter=None):
+        """Released slots of a month, shared with other users camping it; see
+        scan_coordinator."""
+        from bbdc_slot_finder.scan_coordinator import get_scan_coordinator
+
         user_session = self.user_session
-        await asyncio.sleep(random() * 20)
-        suc, data = await browser_check_slot(self._browser_page, month)
+        key = (user_session.profile["courseType"], month)
+        data = await get_scan_coordinator().fetch(
+            key,
+            user_session.chat_id,
+            lambda: self._fetch_c3_slot_released(month, jitter),
+        )
+        if data and "accountBal" in data:
+            user_session.profile["accountBal"] = data["accountBal"]
+        return data
+
+    async def _fetch_c3_slot_released(self, month=None, jitter=None):
+        from bbdc_slot_finder.async_playwright_browser_ops import (
+            list_c3_slot_released as browser_check_slot,
+        )
+
+        await self.pacer.wait(jitter_scale=jitter)
+        start = time.monotonic()
+        suc = None
+        if self._httpx_client is not None:
+            try:
+                suc, data = await self._http_list_c3_slot_released(month)
+            except Exception:
+                self.pacer.record(False, time.monotonic() - start)
+                raise
+        elif SCAN_MODE == "api" and self._api_scan_failures < MAX_API_SCAN_FAILURES:
+            suc, data = await self._api_list_c3_slot_released(month)
+        if not suc and hasattr(self, "_browser_page"):
+            # the page tells an expired login apart from a bad direct request
+            async with self._page_lock:
+                suc, data = await browser_check_slot(self._browser_page, month)
+        self.pacer.record(bool(suc), time.monotonic() - start)
         if suc:
-            if len(data):
-                user_session.profile["accountBal"] = data["accountBal"]
             return data
         elif not suc:
             await self.close_client(stop=True)
             raise TokenExpireError("")
 
+    async def _http_list_c3_slot_released(self, month=None):
+        """Month from the HTTP client. Raises TokenExpireError (after closing
+        the session) if the login is rejected; network errors are raised as
+        they are, the session stays usable."""
+        from bbdc_slot_finder.async_playwright_browser_ops import (
+            api_list_c3_slot_released,
+        )
+
+        payload = self._scan_payload or dict(
+            LIST_SLOT_PAYLOAD, courseType=self.user_session.profile["courseType"]
+        )
+        try:
+            return await api_list_c3_slot_released(
+                self._httpx_client, self.user_session.headers, payload, month
+            )
+        except TokenExpireError:
+            await self.close_client(stop=True)
+            raise
+
+    async def _api_list_c3_slot_released(self, month=None):
+        """Direct request for one month; (None, {}) if it did not work."""
+        from bbdc_slot_finder.async_playwright_browser_ops import (
+            api_list_c3_slot_released,
+        )
+
+        payload = self._scan_payload or dict(
+            LIST_SLOT_PAYLOAD, courseType=self.user_session.profile["courseType"]
+        )
+        try:
+            suc, data = await api_list_c3_slot_released(
+                self._browser_client, self.user_session.headers, payload, month
+            )
+        except Exception as e:
+            logger.warning(f"direct slot request failed: {e}")
+            suc, data = False, {}
+        if suc:
+            self._api_scan_failures = 0
+            return suc, data
+        self._api_scan_failures += 1
+        if self._api_scan_failures == MAX_API_SCAN_FAILURES:
+            logger.warning("direct slot requests keep failing, scanning via the page")
+        return None, {}
+
     async def scan_slots(self):
+        """Yield the SlotEvents (see slot_diff) of each wanted month as it is
+        fetched; user_session.released_slots is updated month by month. Once
+        every month has been fetched, the slots of months no longer open or
+        wanted are reported removed.
+
+        With `scan: {concurrency: n}` in the user config, months after the
+        first are fetched n at a time. Requests are spaced by the account's
+        pacer; `scan: {jitter: s}` overrides its jitter scale.
+        """
+        scan_config = self.user_session.get("scan") or {}
+        concurrency = int(scan_config.get("concurrency", SCAN_CONCURRENCY))
+        if concurrency > 1:
+            scan = self._scan_slots_concurrent(
+                concurrency, scan_config.get("jitter", SCAN_JITTER)
+            )
+        else:
+            scan = self._scan_slots_sequential()
+        slot_diff = self.user_session.slot_diff
+        months = set()
+        async for m, slots_list in scan:
+            months.add(str(m))
+            events = slot_diff.update_month(m, slots_list)
+            if events:
+                yield events
+        events = slot_diff.retain_months(months)
+        if events:
+            yield events
+        logger.info(self.pacer.report())
+
+    async def _scan_slots_concurrent(self, concurrency, jitter):
+        # yields (month, slots) of every wanted month fetched
+        user_session = self.user_session
+        wanted_months = user_session["month"]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(m):
+            async with semaphore:
+                return m, await self.list_c3_slot_released(m, jitter=jitter)
+
+        # the first request tells which month is current and which are open
+        data = await self.list_c3_slot_released(None, jitter=jitter)
+        if not data:
+            return
+        slots_list = BbdcApi.parse_released_slots(data)
+        current_month = None
+        if len(slots_list):
+            current_month = int(list(slots_list.keys())[0][:6])
+            if current_month in wanted_months:
+                logger.info(f"{len(slots_list)} slots found in current month!")
+                yield current_month, slots_list
+        month_visited = {str(current_month)}
+        pending = set()
+
+        def visit(data, m):
+            for month in BbdcApi.parse_available_month(data, wanted_months, m):
+                if month not in month_visited:
+                    month_visited.add(month)
+                    pending.add(asyncio.create_task(fetch(month)))
+
+        visit(data, current_month)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    m, data = task.result()
+                    logger.info(f"requested for month: {m}")
+                    if not data:
+                        continue
+                    slots_list = BbdcApi.parse_released_slots(data)
+                    if len(slots_list):
+                        logger.info(f"{len(slots_list)} slots found!")
+                    yield m, slots_list
+                    visit(data, m)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _scan_slots_sequential(self):
+        # yields (month, slots) of every wanted month fetched
         user_session = self.user_session
         wanted_months = user_session["month"]
-        new_slots_list = {}
         course_type = user_session.profile["courseType"]
         month_to_visit = {None}
         month_visited = []
@@ -353,15 +766,16 @@ class BbdcApi(object):
                         m = int(list(slots_list.keys())[0][:6])
                         month_visited.append(str(m))
                         if m in wanted_months:  #
-                            new_slots_list.update(slots_list)
                             logger.info(
                                 f"{len(slots_list)} slots found in current month!"
                             )
-                            yield slots_list
+                            yield m, slots_list
                     else:
-                        new_slots_list.update(slots_list)
                         logger.info(f"{len(slots_list)} slots found!")
-                        yield slots_list
+                        yield m, slots_list
+                elif m is not None:
+                    # the month is open but fully booked
+                    yield m, slots_list
                 # determine the months to visit
                 avail_month = BbdcApi.parse_available_month(data, wanted_months, m)
                 if m is None:
@@ -370,9 +784,6 @@ class BbdcApi(object):
                 month_to_visit.update(avail_month)
                 month_to_visit.difference_update(month_visited)
                 logger.info(f"requested for month: {m}")
-                await asyncio.sleep(10)
             # else:
             #    # await self.close_client(stop=True)
             #    raise (Exception("No data received"))
-        user_session.released_slots.clear()
-        user_session.released_slots.update(new_slots_list)
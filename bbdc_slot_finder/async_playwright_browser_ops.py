@@ -1,8 +1,13 @@
 from playwright.async_api import async_playwright, expect, Page
 from playwright.async_api import TimeoutError as PlaywrightTimeoutError
-from bbdc_slot_finder.auto_decoder import auto_solve_captcha_data
-from bbdc_slot_finder.exceptions import TokenExpireError
+from bbdc_slot_finder.captcha_service import get_captcha_service
+from bbdc_slot_finder.captcha_cache import captcha_key
+from bbdc_slot_finder.exceptions import TokenExpireError, CaptchaServiceBusy
 from bbdc_slot_finder.const import *
+from bbdc_slot_finder.slots import parse_released_slots
+from bbdc_slot_finder.slot_store import SlotStore
+from bbdc_slot_finder.event_loop import append_to_file, run_blocking
+import asyncio
 import json
 import random
 import time
@@ -14,49 +19,6 @@ import os
 DEBUG = os.environ.get("BBDC_BOT_DEBUG", False)
 logger = logging.getLogger(__name__)
 MAX_BOOKING_DATES = 3
-import json
-
-
-def parse_released_slots(data: dict) -> dict:
-    """Parse released slots data and return a dictionary of parsed slot information.
-
-    Args:
-        data (dict): A dictionary containing released slot data.
-
-    Returns:
-        dict: A dictionary containing parsed slot information with slot keys and corresponding details.
-    """
-    if not data:
-        return
-    slot_list = {}
-    slot_data = data["releasedSlotListGroupByDay"]
-    if slot_data is None:
-        return slot_list
-    for day, slots in slot_data.items():
-        date = datetime.datetime.fromisoformat(day).strftime("%Y%m%d")
-        for slot in slots:
-            slotDate_code = date + slot["slotRefName"].split(" ")[1]
-            # slotDate_code = date + slot["slotRefName"].split(" ")[1]  # %Y%m%d\d-\d+
-            slot_key = f"{slotDate_code}-{slot['slotId']}"
-            slot_list.update(
-                {
-                    slot_key: {
-                        "payload": {
-                            "slotIdEnc": slot["slotIdEnc"],
-                            "bookingProgressEnc": slot["bookingProgressEnc"],
-                        },
-                        "slot_id": int(slot["slotId"]),
-                        "total_fee": slot["totalFee"],
-                        "slots_code": f"{slotDate_code}-{slot['slotId']}",
-                        "slot_date": day[:10],
-                        "group": slot["c3PsrFixGrpNo"],
-                        "session": slot["slotRefName"].split(" ")[1],
-                        "start_time": slot["startTime"],
-                        "end_time": slot["endTime"],
-                    }
-                }
-            )
-    return slot_list
 
 
 async def log_request_response(request, directory="."):
@@ -81,17 +43,45 @@ async def log_request_response(request, directory="."):
 
     # 保存日志数据到文件
     file_name = f"logs/log_rq.json"
-    with open(file_name, "a+") as f:
-        json.dump(log_data, f, indent=4)
-        f.write(",\n")
+    await append_to_file(file_name, json.dumps(log_data, indent=4) + ",\n")
         # 监听请求和响应事件
 
 
 async def save_cookies(page, directory):
     # Save cookies
     cookies = await page.context.cookies("https://booking.bbdc.sg")
-    with open(f"{directory}/cookies.json", "w") as f:
-        json.dump(cookies, f)
+    await run_blocking(_write_json, f"{directory}/cookies.json", cookies)
+
+
+def _write_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+def _merge_logged_headers(directory):
+    # headers.json takes the headers of the last logged request
+    with open("logs/log_rq.json", "r") as f:
+        text = f.read()
+        headers = json.loads(text[:-2] + "]")[-1]["request_headers"]
+    with open(f"{directory}/headers.json", "r") as f:
+        header_old = json.loads(f.read())
+        header_old.update(headers)
+    _write_json(f"{directory}/headers.json", header_old)
+
+
+async def _report_login_captcha(page: Page, key, verdict):
+    """Report a login captcha as rejected only when the server said so; a
+    login that failed for another reason says nothing about the answer."""
+    if "loginCaptcha" not in page.url:
+        verdict.cancel()
+        get_captcha_service().report(key, True)
+        return
+    try:
+        response = await (await verdict).json()
+    except Exception:
+        return
+    if "Incorrect Captcha" in str(response.get("message")):
+        get_captcha_service().report(key, False)
 
 
 async def login_bbdc(config, page: Page, directory="."):
@@ -112,7 +102,7 @@ async def login_bbdc(config, page: Page, directory="."):
 
         while "loginCaptcha" in page.url:
             if trial_count == 0:
-                await solve_playwright_captcha(
+                key = await solve_playwright_captcha(
                     page, None, auth_getLoginCaptchaImage, response
                 )
 
@@ -123,13 +113,16 @@ async def login_bbdc(config, page: Page, directory="."):
                 async with page.expect_response("**/getLoginCaptchaImage") as first:
                     await page.locator(".v-responsive__content").click()
                 response = await first.value
-                await solve_playwright_captcha(
+                key = await solve_playwright_captcha(
                     page,
                     None,
                     auth_getLoginCaptchaImage,
                 )
             trial_count += 1
 
+            verdict = asyncio.ensure_future(
+                page.wait_for_response(f"**/{auth_Login}", timeout=10000)
+            )
             await page.get_by_role("button", name="Verify").click()
             try:
                 await page.wait_for_url(
@@ -137,6 +130,7 @@ async def login_bbdc(config, page: Page, directory="."):
                 )
             except:
                 pass
+            await _report_login_captcha(page, key, verdict)
         if "loginCaptcha" in page.url:
             return False
         logger.debug("Logged in...")
@@ -204,6 +198,27 @@ async def list_c3_slot_released(
             return data["success"], data["data"]
 
 
+async def api_list_c3_slot_released(client, headers, payload, m: str = None):
+    """
+    Fetch one month straight from the backend with the page's authenticated
+    APIRequestContext, without touching the DOM. Same return value as
+    list_c3_slot_released.
+    Args:
+        client (APIRequestContext): page.request of a logged-in page
+        headers (dict): the user's saved request headers (authorization etc.)
+        payload (dict): request body, as sent by the SPA
+        m (str): month like "202407"; None for the SPA's default month
+    """
+    payload = dict(payload, releasedSlotMonth=None if m is None else str(m))
+    response = await client.post(
+        booking_listC3PracticalSlotReleased, headers=headers, data=payload
+    )
+    if not response.ok:
+        return False, {}
+    data = await response.json()
+    return data["success"], data["data"] or {}
+
+
 async def go_to_booking(page):
     "from other pages to chooseslot page;"
     button_locator = (
@@ -228,6 +243,17 @@ async def go_to_booking(page):
     await page.get_by_role("button", name="NEXT").click()
 
 
+async def solve_captcha_data(data) -> str:
+    """Solve captcha json in the captcha worker pool; "" if it fails or times out."""
+    try:
+        return await get_captcha_service().solve(data)
+    except (asyncio.TimeoutError, CaptchaServiceBusy) as e:
+        logger.warning(f"captcha solve skipped: {e!r}")
+    except Exception as e:
+        logger.error(f"captcha solve failed: {e}")
+    return ""
+
+
 async def solve_playwright_captcha(
     page: Page,
     trigger_button_name="CONFIRM",
@@ -244,15 +270,19 @@ async def solve_playwright_captcha(
                     page, None, auth_getLoginCaptchaImage, response
                 )
     For booking page: solve_playwright_captcha
+    Returns the captcha_key of the image answered, to report the server's
+    verdict to the captcha service.
     """
     captcha = ""
+    data = None
     counter = 0
     # choices: pass the response directly, or press the trigger button
     if response:
         data = await response.json()
         data = data["data"]
-        captcha = auto_solve_captcha_data(data)
+        captcha = await solve_captcha_data(data)
         counter += 1
+    trigger_button = None
     if trigger_button_name:
         trigger_button = page.get_by_role("button", name=trigger_button_name)
         await expect(trigger_button).to_be_visible()
@@ -266,28 +296,32 @@ async def solve_playwright_captcha(
             img_locator = page.locator(".v-responsive__content")
             # regresh the captcha image if is visible, or press trigger button
             img_locator_visible = await img_locator.is_visible()
-            if img_locator_visible:
+            if img_locator_visible or trigger_button is None:
+                # no trigger button: the dialog is open, wait for its image
                 await img_locator.click()
             else:
                 await trigger_button.click()
         result_response = await first.value
         data = await result_response.json()
         data = data["data"]
-        captcha = auto_solve_captcha_data(data)
+        captcha = await solve_captcha_data(data)
     await page.get_by_label(captcha_label).click()
     await page.get_by_label(captcha_label).fill(captcha)
+    return captcha_key(data) if data else None
 
     # page.get_by_label("Captcha").click()
     # page.get_by_label("Captcha").fill(captcha)
     # page.get_by_role("button", name="Verify").click()
 
 
-async def select_slots(page: Page, slots: dict = None, select_all=False):
+async def select_slots(page: Page, slots: SlotStore = None, select_all=False):
     # get list of buttons for all dates
     # page.locator(".calendar-col").locator(".title").inner_text() # example: 'APR 2025'
     # Next step: confirm
     # click Month
-    m = list(slots.keys())[0][:6]
+    if not isinstance(slots, SlotStore):
+        slots = SlotStore(slots)
+    m = slots.months()[0]
     month_code = datetime.datetime.strptime(str(m), "%Y%m").strftime(
         "%b"
     )  # example: 'Apr'
@@ -313,8 +347,8 @@ async def select_slots(page: Page, slots: dict = None, select_all=False):
             await i.click()
     else:
         # put slots into groups of days
-        days = set(i[6:8] for i in slots.keys())  # example: {'202504291-2345678', ...}
-        reg_days = "(" + "|".join(sorted(days)) + ")"  # example: "(24|28)"
+        days = [d[8:10] for d in slots.dates()]  # example: ['24', '28']
+        reg_days = "(" + "|".join(days) + ")"  # example: "(24|28)"
         buttons = (
             await page.locator(".calendar-col")
             .get_by_role("button", name=re.compile(reg_days))
@@ -330,11 +364,9 @@ async def select_slots(page: Page, slots: dict = None, select_all=False):
         )  # .locator(".sessionCard").locator("visible=true")
         for k, slot in slots.items():
             try:
-                date = datetime.datetime.strptime(
-                    slot["slot_date"], "%Y-%m-%d"
-                ).strftime("%d %b %Y")
+                date = slot.day.strftime("%d %b %Y")
                 await sessions.filter(has_text=date).filter(
-                    has_text="SESSION " + slot["session"]
+                    has_text="SESSION " + slot.session
                 ).click(timeout=3000)
             except PlaywrightTimeoutError:
                 logger.info("timeoutime  t")
@@ -359,15 +391,86 @@ async def select_slots(page: Page, slots: dict = None, select_all=False):
         return False
 
 
-async def book_slots(page: Page):
-    """on page: pop-up dialog to confirm booking"""
-    await solve_playwright_captcha(page)
+class CaptchaPrefetcher(object):
+    """
+    Start solving a captcha the moment its image response lands, instead of
+    after the dialog has rendered and the response has been awaited.
+    Usage: start() before the click that requests the image, then
+    `await result()`; stop() afterwards.
+    """
+
+    def __init__(self, page: Page, response_api=booking_getCaptchaImage, start=None):
+        self.page = page
+        self.response_api = response_api
+        self.start_time = start or time.perf_counter()
+        self.timings = {}
+        self._task = None
+        self._arrived = asyncio.Event()
+
+    def _on_response(self, response):
+        if self._task is None and response.url.endswith(self.response_api):
+            self.timings["captcha_response"] = time.perf_counter() - self.start_time
+            self._task = asyncio.ensure_future(self._solve(response))
+            self._arrived.set()
+
+    async def _solve(self, response):
+        data = await response.json()
+        data = data["data"]
+        captcha = await solve_captcha_data(data)
+        self.timings["captcha_solved"] = time.perf_counter() - self.start_time
+        return captcha, captcha_key(data)
+
+    def start(self):
+        self.page.on("response", self._on_response)
+
+    def stop(self):
+        self.page.remove_listener("response", self._on_response)
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    async def result(self, timeout=20):
+        """(captcha, captcha_key) of the first captcha image seen."""
+        await asyncio.wait_for(self._arrived.wait(), timeout)
+        return await asyncio.wait_for(asyncio.shield(self._task), timeout)
+
+
+async def _submit_booking(page: Page, key):
     async with page.expect_response("**/callBookC3PracticalSlot") as first:
         await page.get_by_role("dialog").filter(has_text="Captcha").get_by_role(
             "button", name="Confirm"
         ).click()
     response = await first.value
     response = await response.json()
+    if response["success"]:
+        get_captcha_service().report(key, True)
+    elif "Incorrect Captcha" in str(response["message"]):
+        get_captcha_service().report(key, False)
+    return response
+
+
+async def book_slots(page: Page, pipelined=False, timings=None):
+    """
+    on page: pop-up dialog to confirm booking
+    pipelined: solve the captcha while the dialog renders (see
+        book_slots_pipelined) instead of one step after another.
+    timings (dict, optional): filled with seconds since the start for
+        "captcha_ready", "submitted" and "booked" (plus the pipelined extras),
+        so the two modes can be compared from the log.
+    """
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    if pipelined:
+        key = await book_slots_pipelined(page, timings, start)
+    else:
+        key = await solve_playwright_captcha(page)
+        timings["captcha_ready"] = time.perf_counter() - start
+    timings["submitted"] = time.perf_counter() - start
+    response = await _submit_booking(page, key)
+    timings["booked"] = time.perf_counter() - start
+    logger.info(
+        f"booking timings ({'pipelined' if pipelined else 'serial'}): "
+        + ", ".join(f"{k}={v:.3f}s" for k, v in timings.items())
+    )
     if response["success"]:
         await page.reload()
         await go_to_booking(page)
@@ -376,6 +479,49 @@ async def book_slots(page: Page):
         return False, response["message"]
 
 
+async def book_slots_pipelined(page: Page, timings, start):
+    """
+    Trigger the captcha, then wait for the dialog and solve the captcha at the
+    same time; fill it in as soon as both are done. Falls back to the
+    refresh loop of solve_playwright_captcha if the answer is not 5 chars.
+    Returns the captcha_key of the image answered.
+    """
+    prefetcher = CaptchaPrefetcher(page, start=start)
+    prefetcher.start()
+    try:
+        img_locator = page.locator(".v-responsive__content")
+        if await img_locator.is_visible():
+            # dialog still open from a failed attempt: refresh the image
+            await img_locator.click()
+        else:
+            await page.get_by_role("button", name="CONFIRM").click()
+        captcha_input = page.get_by_label("Captcha")
+        await captcha_input.wait_for(state="visible")
+        timings["dialog_ready"] = time.perf_counter() - start
+        try:
+            captcha, key = await prefetcher.result()
+        except Exception as e:
+            # e.g. timeout, busy service, failed solve: use the refresh loop
+            logger.warning(f"prefetched captcha unavailable: {e!r}")
+            captcha, key = "", None
+    finally:
+        prefetcher.stop()
+    timings.update(prefetcher.timings)
+    if len(captcha) == 5:
+        await captcha_input.fill(captcha)
+    else:
+        key = await solve_playwright_captcha(page, trigger_button_name=None)
+    timings["captcha_ready"] = time.perf_counter() - start
+    if "captcha_response" in timings and "captcha_solved" in timings:
+        # solving time hidden behind the dialog rendering
+        timings["overlap"] = max(
+            min(timings["dialog_ready"], timings["captcha_solved"])
+            - timings["captcha_response"],
+            0,
+        )
+    return key
+
+
 async def authentication_page(username, password, page: Page):
     await page.get_by_label("Login ID").click()
     await page.get_by_placeholder("example: 567A02071990").fill(username)
@@ -467,7 +613,29 @@ async def intercept_and_add_jsessionid(page, directory):
         print(e)
 
 
-async def build_bbdc_browser(p, debug, headless, directory, refresh_token):
+async def launch_bbdc_chromium(p, headless):
+    # userDataDir = "user_data"
+    # path_to_extension = "/Users/yangly/Library/Application Support/Microsoft Edge/Default/Extensions"
+    # Make sure to run headed.
+    return await p.chromium.launch(
+        headless=headless,
+        args=[
+            "--enable-automation",
+            "--window-size=1280,900",
+            "--disable-infobars",
+            # f"--disable-extensions-except={path_to_extension}",
+            # f"--load-extension={path_to_extension}",
+        ],
+    )
+
+
+async def new_bbdc_context(browser_, debug, directory, refresh_token):
+    """Open an isolated context on a running Chromium, logged in from
+    `{directory}/auth.json` unless refresh_token is set.
+
+    Returns:
+        (BrowserContext, Page)
+    """
     async def handle_bbdc_response(response):
         if "bbdc-back-service" in response.url and (
             "listC3PracticalSlotReleased" not in response.url
@@ -478,17 +646,15 @@ async def build_bbdc_browser(p, debug, headless, directory, refresh_token):
                 try:
                     payload = await request_response.json()
                     payload = payload["data"]
-                    with open(f"{directory}/profile.json", "w") as f:
-                        json.dump(payload["enrolDetail"], f)
+                    await run_blocking(
+                        _write_json, f"{directory}/profile.json", payload["enrolDetail"]
+                    )
                     logger.debug("save user profile")
                 except:
                     logger.error("fail to save save user profile")
             if "Captcha" in response.url:
                 pass
 
-    # userDataDir = "user_data"
-    # path_to_extension = "/Users/yangly/Library/Application Support/Microsoft Edge/Default/Extensions"
-    # Make sure to run headed.
     debug_kwargs = {}
     if debug:
         debug_kwargs.update(
@@ -501,16 +667,6 @@ async def build_bbdc_browser(p, debug, headless, directory, refresh_token):
     storage_state = not refresh_token
     state = f"{directory}/auth.json" if storage_state else None
 
-    browser_ = await p.chromium.launch(
-        headless=headless,
-        args=[
-            "--enable-automation",
-            "--window-size=1280,900",
-            "--disable-infobars",
-            # f"--disable-extensions-except={path_to_extension}",
-            # f"--load-extension={path_to_extension}",
-        ],
-    )
     browser = await browser_.new_context(
         # user_data_dir=userDataDir,
         user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36 Edg/127.0.0.0",
@@ -532,6 +688,11 @@ async def build_bbdc_browser(p, debug, headless, directory, refresh_token):
     return browser, page
 
 
+async def build_bbdc_browser(p, debug, headless, directory, refresh_token):
+    browser_ = await launch_bbdc_chromium(p, headless)
+    return await new_bbdc_context(browser_, debug, directory, refresh_token)
+
+
 async def start_browser(
     config,
     headless=False,
@@ -551,9 +712,7 @@ async def start_browser(
             async with page.expect_response(
                 "**/listC3PracticalSlotReleased", timeout=30000
             ) as res:
-                await page.goto(
-                    "https://booking.bbdc.sg/?#/booking/chooseSlot?courseType=3C&insInstructorId=&instructorType="
-                )
+                await page.goto(bbdc_chooseslot_url)
             response = await res.value
             res_data = await response.json()
             if res_data["success"] is False:
@@ -587,12 +746,5 @@ async def start_browser(
         await browser.close()
 
     if refresh_token and success:
-        with open("logs/log_rq.json", "r") as f:
-            text = f.read()
-            headers = json.loads(text[:-2] + "]")[-1]["request_headers"]
-        with open(f"{directory}/headers.json", "r") as f:
-            header_old = json.loads(f.read())
-            header_old.update(headers)
-        with open(f"{directory}/headers.json", "w") as f:
-            json.dump(header_old, f)
+        await run_blocking(_merge_logged_headers, directory)
     return True
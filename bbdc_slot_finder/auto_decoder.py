@@ -1,10 +1,12 @@
 #!/usr/bin/python3
 # coding: utf-8
 import os
-import pytesseract
+import threading
+import time
 import argparse
 from bbdc_slot_finder.logger import logger
-from collections import Counter
+from bbdc_slot_finder.ocr import get_ocr_backend, PSM_LINE, PSM_CHAR
+from bbdc_slot_finder.char_classifier import get_char_classifier, MIN_MARGIN
 import numpy as np
 
 try:
@@ -12,14 +14,33 @@ try:
 except ImportError:
     from PIL import Image, ImageOps, ImageFilter
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import base64
 
 DEBUG = os.environ.get("BBDC_BOT_DEBUG", False)
 
 
-def auto_solve_captcha_data(captcha_data):
+# preprocessing/OCR variants tried by solve_captcha_multi
+CAPTCHA_VARIANTS = [
+    {"threshold": 225, "blur": 1, "psm": PSM_LINE},
+    {"threshold": 200, "blur": 1, "psm": PSM_LINE},
+    {"threshold": 240, "blur": 1, "psm": PSM_LINE},
+    {"threshold": 225, "blur": 0, "psm": PSM_LINE},
+    {"threshold": 225, "blur": 2, "psm": PSM_LINE},
+    {"chars": True},
+]
+# stop waiting for other variants once a 5-char answer is this confident
+EARLY_EXIT_CONFIDENCE = 90
+# threads shared by all solve_captcha_multi calls; fewer than the variants, so
+# the variants still queued when an answer is found are never run
+VARIANT_WORKERS = 3
+_variant_pool = None
+_variant_pool_lock = threading.Lock()
+
+
+def auto_solve_captcha_data(captcha_data, mode="single"):
     bio = get_captcha_image(captcha_data)
-    captcha = get_captcha(bio, auto=True)
+    captcha = get_captcha(bio, auto=True, mode=mode)
     return captcha
 
 
@@ -61,7 +82,8 @@ def calculate_noise_count(img_obj, w, h):
     return count
 
 
-def operate_img(img, k):
+def operate_img_reference(img, k):
+    """Original per-pixel denoiser, kept as the reference for operate_img."""
     w, h, s = img.shape
     # 从高度开始遍历
     for _w in range(w):
@@ -76,13 +98,117 @@ def operate_img(img, k):
     return img
 
 
-def solve_captcha(path, debug=False):
+def operate_img(img, k):
+    """
+    Whiten every pixel with at most k non-white neighbours.
+    Vectorised equivalent of operate_img_reference: the reference scans in place
+    row by row, so the row above and the left neighbour are read after they
+    have been cleaned. Rows are therefore processed one at a time with shifted
+    sums over the columns, and the left-neighbour dependency is resolved by a
+    forward fill over the (rare) pixels whose count sits exactly at k.
+    Args:
+        img: np.ndarray of shape (rows, cols, 3), modified in place
+        k: max number of non-white neighbours for a pixel to be removed
+    Returns:
+        img
+    """
+    rows, cols, _ = img.shape
+    if rows < 2 or cols < 2:
+        return img
+    mask = (img <= 233).any(axis=2)
+    # the last row / column is never counted as a neighbour
+    mask[rows - 1, :] = False
+    mask[:, cols - 1] = False
+    # pad one column on each side and one row below
+    padded = np.zeros((rows + 1, cols + 2), dtype=np.int8)
+    padded[:rows, 1 : cols + 1] = mask
+    index = np.arange(cols)
+    for r in range(1, rows):
+        above = padded[r - 1, :-2] + padded[r - 1, 1:-1] + padded[r - 1, 2:]
+        below = padded[r + 1, :-2] + padded[r + 1, 1:-1] + padded[r + 1, 2:]
+        left = padded[r, :-2].astype(bool)
+        base = above + below + padded[r, 2:]
+        whiten = base < k
+        tie = base == k
+        whiten |= tie & ~left
+        # a tied pixel whose left neighbour is non-white is removed iff the
+        # left neighbour itself was removed
+        chain = tie & left
+        whiten[0] = chain[0] = False
+        if chain.any():
+            source = np.maximum.accumulate(np.where(chain, 0, index))
+            whiten = whiten[source]
+        whiten[0] = False
+        img[r, whiten] = 255
+        padded[r, 1 : cols + 1] = mask[r] & ~whiten
+    return img
+
+
+def filter_main_colours(image):
+    """
+    Keep the 11 most common colours after the background, whiten the rest.
+    Colours are packed into 24-bit integers so counting and filtering run on
+    arrays; ties are ordered by first occurrence, like Counter.most_common.
+    Args:
+        image: RGB PIL image
+    Returns:
+        np.ndarray of shape (rows, cols, 3), dtype uint8
+    """
+    img_dt = np.asarray(image, dtype=np.uint8)
+    packed = (
+        (img_dt[..., 0].astype(np.uint32) << 16)
+        | (img_dt[..., 1].astype(np.uint32) << 8)
+        | img_dt[..., 2]
+    )
+    colours, first_seen, counts = np.unique(
+        packed.ravel(), return_index=True, return_counts=True
+    )
+    main_colours = colours[np.lexsort((first_seen, -counts))[1:12]]
+    keep = np.isin(packed, main_colours)
+    return np.where(keep[..., None], img_dt, np.uint8(255))
+
+
+def _record_stage(timings, stage, start):
+    """Add the time since start to timings[stage]; return the current time."""
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0) + now - start
+    return now
+
+
+def preprocess_captcha(path, timings=None):
+    """
+    Decode, colour-filter and denoise a captcha image.
+    Args:
+        path: path or file object of the image
+        timings (dict, optional): accumulates seconds spent per stage
+    Returns:
+        RGB PIL image with a white border, ready for thresholding/OCR
+    """
+    start = time.perf_counter()
+    image = Image.open(path).convert("RGB")
+    # image.convert("RGB")
+    image = ImageOps.autocontrast(image)
+    # image.show()
+    start = _record_stage(timings, "decode", start)
+
+    img_dt = filter_main_colours(image)
+    start = _record_stage(timings, "colour_filter", start)
+    img_dt = operate_img(img_dt, 3)
+    _record_stage(timings, "denoise", start)
+    copy = Image.fromarray(img_dt)
+    return ImageOps.expand(copy, border=(3, 3), fill="white")
+
+
+def solve_captcha(path, debug=False, timings=None):
     """
     Convert a captcha image into a text,
     using PyTesseract Python-wrapper for Tesseract
     Arguments:
         path (str):
             path to the image to be processed
+        timings (dict, optional):
+            accumulates seconds spent per stage
     Return:
         'textualized' image
 
@@ -93,29 +219,7 @@ def solve_captcha(path, debug=False):
     4. Apply Box Blur to fill in gaps and process into B/W image for OCR
     5. Use Tesseract
     """
-    image = Image.open(path).convert("RGB")
-    # image.convert("RGB")
-    image = ImageOps.autocontrast(image)
-    # image.show()
-
-    # Get List Of Main Colors
-    pixel_count = Counter(image.getdata())
-    main_colours = pixel_count.most_common(12)[1:]
-
-    # Filtering Colours
-    copy = image.copy()
-    pixels = copy.load()
-    main_colours_list = list(zip(*main_colours))[0]
-    for x in range(image.size[0]):  # For Every Pixel:
-        for y in range(image.size[1]):
-            if (
-                pixels[x, y] not in main_colours_list
-            ):  # Change All Non-Main Colour to White
-                pixels[x, y] = (255, 255, 255)
-    img_dt = np.array(copy)
-    img_dt = operate_img(img_dt, 3)
-    copy = Image.fromarray(img_dt)
-    copy = ImageOps.expand(copy, border=(3, 3), fill="white")
+    copy = preprocess_captcha(path, timings)
     if debug:
         # copy.show()
         pass
@@ -131,36 +235,16 @@ def solve_captcha(path, debug=False):
 
     # OCR Part
     def OCR(image):
-        data = pytesseract.image_to_data(
-            image,
-            output_type="data.frame",
-            config=(
-                "-c tessedit"
-                "_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
-                " -c tessedit"
-                "_char_blacklist=!?"
-                " --psm 7"
-                " --oem 3"
-            ),
-        )
-        logger.debug(
-            "Text: {} | Confidence: {}%".format(data.text[4], int(data.conf[4]))
-        )
-        return (str(data.text[4]), int(data.conf[4]))
-
-        data = pytesseract.image_to_string(
-            image,
-            config=(
-                "-c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
-                " -c tessedict_char_blacklist=!?-_"
-                f" --psm 10"
-                " --oem 3"
-            ),
-        )
-        logger.debug(f"Auto OCR Text: {data}")
-        return str(data).strip("\n ")
+        text, conf = get_ocr_backend().recognise(image, psm=PSM_LINE)
+        logger.debug("Text: {} | Confidence: {}%".format(text, conf))
+        return (text, conf)
 
-    return OCR(fillHoles(copy, 225))
+    start = time.perf_counter()
+    text = fillHoles(copy, 225)
+    start = _record_stage(timings, "threshold", start)
+    result = OCR(text)
+    _record_stage(timings, "ocr", start)
+    return result
 
 
 def base64img(encoded_data):
@@ -171,9 +255,12 @@ def base64img(encoded_data):
     return fh
 
 
-def get_captcha(img, auto=False):
+def get_captcha(img, auto=False, mode="single"):
     if auto:
-        captcha, conf = solve_captcha(img)
+        if mode == "multi":
+            captcha, conf = solve_captcha_multi(img)
+        else:
+            captcha, conf = solve_captcha(img)
         # logger.info(f"Auto solve captcha: {captcha} with confidence {conf}")
     else:
         Image.open(img).convert("RGB").show()
@@ -181,6 +268,25 @@ def get_captcha(img, auto=False):
     return captcha
 
 
+def verify_operate_img(captcha_file="logs/captcha.txt", k=3):
+    """
+    Check operate_img against operate_img_reference on the logged captchas.
+    Returns:
+        (number of captchas checked, list of line numbers that differ)
+    """
+    with open(captcha_file, "r") as f:
+        cps = [i.strip() for i in f.readlines() if i.strip()]
+    mismatch = []
+    for n, i in enumerate(cps):
+        image = ImageOps.autocontrast(Image.open(base64img(i)).convert("RGB"))
+        img_dt = filter_main_colours(image)
+        expected = operate_img_reference(img_dt.copy(), k)
+        if not np.array_equal(operate_img(img_dt, k), expected):
+            mismatch.append(n)
+    logger.info(f"operate_img checked on {len(cps)} captchas, {len(mismatch)} differ")
+    return len(cps), mismatch
+
+
 def test(cps):
     with open("logs/captcha.txt", "r") as f:
         cps = f.readlines()
@@ -192,16 +298,97 @@ def test(cps):
     # Fill holes using box blur then flatten into B/W image
 
 
-def fillHoles(text, thresh):
-    text = text.filter(ImageFilter.BoxBlur(1))
+def fillHoles(text, thresh, blur=1):
+    if blur:
+        text = text.filter(ImageFilter.BoxBlur(blur))
     fn = lambda x: 255 if x > thresh else 0
     text = text.convert("L").point(fn, mode="1")
     # text.show()
     return text
 
 
-def divide_and_conquer_ocr(text):
-    import numpy as np
+def ocr_variant(copy, variant, stop=None):
+    """
+    Threshold and OCR a preprocessed captcha with one entry of CAPTCHA_VARIANTS.
+    Args:
+        stop (threading.Event): set once another variant has answered
+    Returns:
+        (text, confidence); None if stopped before running
+    """
+    if stop is not None and stop.is_set():
+        return None
+    if variant.get("chars"):
+        return divide_and_conquer_ocr(copy, return_conf=True, stop=stop)
+    text = fillHoles(copy, variant["threshold"], variant["blur"])
+    return get_ocr_backend().recognise(text, psm=variant["psm"])
+
+
+def _get_variant_pool():
+    global _variant_pool
+    with _variant_pool_lock:
+        if _variant_pool is None:
+            _variant_pool = ThreadPoolExecutor(
+                max_workers=VARIANT_WORKERS, thread_name_prefix="captcha-variant"
+            )
+        return _variant_pool
+
+
+def solve_captcha_multi(path, variants=None, timings=None):
+    """
+    Run several preprocessing/OCR variants on one captcha concurrently and
+    return the most confident 5-character answer, or the most confident answer
+    of any length if none has 5 characters. Returns as soon as a 5-character
+    answer reaches EARLY_EXIT_CONFIDENCE; variants not started by then are
+    skipped.
+
+    Whole-line variants are ranked by Tesseract's word confidence. The
+    per-character variant's confidence mixes classifier margins and
+    per-character confidences, so it is ranked on its own and only chosen
+    when no line variant read 5 characters.
+    Returns:
+        (text, confidence)
+    """
+    variants = variants or CAPTCHA_VARIANTS
+    copy = preprocess_captcha(path, timings)
+    start = time.perf_counter()
+    candidates = []
+    stop = threading.Event()
+    pool = _get_variant_pool()
+    futures = {pool.submit(ocr_variant, copy, v, stop): v for v in variants}
+    try:
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.warning(f"captcha variant failed: {e}")
+                continue
+            if result is None:
+                continue
+            text, conf = result
+            line = not futures[future].get("chars")
+            candidates.append((len(text) == 5, line, conf, text))
+            if line and len(text) == 5 and conf >= EARLY_EXIT_CONFIDENCE:
+                break
+    finally:
+        stop.set()
+        for future in futures:
+            future.cancel()
+    _record_stage(timings, "ocr", start)
+    if not candidates:
+        return "", -1
+    _, _, conf, text = max(candidates)
+    logger.debug(f"Captcha candidates: {candidates}, chosen {text}")
+    return text, conf
+
+
+def segment_characters(text):
+    """
+    Split a preprocessed captcha into per-character crops along contours.
+    Args:
+        text: RGB PIL image from preprocess_captcha
+    Returns:
+        list of binary (white on black) uint8 crops, left to right
+    """
     import cv2
 
     cv2_img = cv2.cvtColor(np.array(text), cv2.COLOR_RGB2BGR)
@@ -211,11 +398,6 @@ def divide_and_conquer_ocr(text):
     contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     contours = sorted(contours, key=lambda c: cv2.boundingRect(c)[0])
     # 循环遍历每个轮廓，保存每个字母
-    custom_config = (
-        "-c tessedit"
-        "_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
-        + "  --psm 10"
-    )
     borders = [
         [0, 0],
     ]
@@ -228,12 +410,33 @@ def divide_and_conquer_ocr(text):
     if len(borders) > 6:
         # print("wrong!")
         pass
+    return [thresh[:, i:j] for i, j in borders[1:]]
+
+
+def divide_and_conquer_ocr(text, timings=None, return_conf=False, stop=None):
+    """
+    OCR a preprocessed captcha one character at a time. Characters the
+    template classifier is sure about skip Tesseract; the rest fall back to it.
+    Gives up between characters once `stop` (threading.Event) is set.
+    """
+    import cv2
+
+    start = time.perf_counter()
+    crops = segment_characters(text)
+    start = _record_stage(timings, "segment", start)
+    classifier = get_char_classifier()
+    ocr_backend = None
     text = ""
-    for i, j in borders[1:]:
-        char_image = thresh[:, i:j]
-        if char_image.sum() < 10000:
-            # print("skip a character!")
-            pass
+    confs = []
+    for char_image in crops:
+        if stop is not None and stop.is_set():
+            break
+        if classifier is not None:
+            char, margin = classifier.classify(char_image)
+            if margin >= MIN_MARGIN:
+                text += char
+                confs.append(int(100 * margin))
+                continue
         left_padding = 10  # 左边黑色空间的宽度
         right_padding = 10  # 右边黑色空间的宽度
 
@@ -246,52 +449,42 @@ def divide_and_conquer_ocr(text):
             borderType=cv2.BORDER_CONSTANT,
             value=[0, 0, 0],
         )
-        char_image_pil = Image.fromarray(cv2.cvtColor(char_image, cv2.COLOR_BGR2RGB))
+        char_image_pil = Image.fromarray(cv2.cvtColor(char_image, cv2.COLOR_GRAY2RGB))
         # char_image_pil.show()
-        char = pytesseract.image_to_string(char_image_pil, config=custom_config).strip(
-            "\n "
-        )
+        ocr_backend = ocr_backend or get_ocr_backend()
+        char, conf = ocr_backend.recognise(char_image_pil, psm=PSM_CHAR)
         if len(char):
             char = char[0]
         text += char
+        confs.append(conf)
+    _record_stage(timings, "ocr", start)
+    if return_conf:
+        return text, int(sum(confs) / len(confs)) if confs else -1
     return text
 
 
 def OCR(image):
-    data = pytesseract.image_to_data(
-        image,
-        output_type="data.frame",
-        config=(
-            "-c tessedit"
-            "_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
-            " -c tessedit"
-            "_char_blacklist=!?"
-            " --psm 10"
-            " --oem 3"
-        ),
-    )
-    logger.debug("Text: {} | Confidence: {}%".format(data.text[4], int(data.conf[4])))
-    return (str(data.text[4]), int(data.conf[4]))
-
-    data = pytesseract.image_to_string(
-        image,
-        config=(
-            "-c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
-            " -c tessedict_char_blacklist=!?-_"
-            f" --psm 10"
-            " --oem 3"
-        ),
-    )
-    logger.debug(f"Auto OCR Text: {data}")
-    return str(data).strip("\n ")
+    text, conf = get_ocr_backend().recognise(image, psm=PSM_CHAR)
+    logger.debug("Text: {} | Confidence: {}%".format(text, conf))
+    return (text, conf)
 
 
 if __name__ == "__main__":
     argparser = argparse.ArgumentParser()
-    argparser.add_argument(
-        "-i", "--image", required=True, help="path to input image to be OCR'd"
+    group = argparser.add_mutually_exclusive_group(required=True)
+    group.add_argument("-i", "--image", help="path to input image to be OCR'd")
+    group.add_argument(
+        "--verify-denoise",
+        metavar="CAPTCHA_FILE",
+        nargs="?",
+        const="logs/captcha.txt",
+        help="compare operate_img with the reference loop on logged captchas",
     )
     args = vars(argparser.parse_args())
+    if args["verify_denoise"]:
+        total, mismatch = verify_operate_img(args["verify_denoise"])
+        print(f"-- Checked {total} captchas, mismatched lines: {mismatch}")
+        raise SystemExit(1 if mismatch else 0)
     path = args["image"]
     print("-- Resolving")
     captcha_text = solve_captcha(path)[0]
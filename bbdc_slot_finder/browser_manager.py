@@ -0,0 +1,406 @@
+#!/usr/bin/python3
+# coding: utf-8
+"""
+Process-wide Chromium shared by all user sessions, with a warm page pool.
+
+The Playwright driver and Chromium are started once (one browser per headless
+mode) and every session gets its own BrowserContext, loaded from its
+auth.json storage state. Contexts are isolated from each other (cookies,
+storage, routes), so closing or losing one does not affect the others.
+
+For every user that has opened a page, `warm_pages` further pages are kept
+authenticated and already on the chooseSlot page in the background, so the
+next /check, /myschedule or camper run starts without a browser cold start.
+Pages handed back by `release` go back to the pool. A pooled page is recycled
+once it has been idle for `idle_ttl` seconds or has sent `max_requests`
+backend requests. A user that has not acquired a page for `idle_ttl` seconds,
+or whose camp job ended (`forget`), is no longer kept warm, and the reaper
+stops once nobody is.
+
+Pages are scan-only by default: a route profile aborts images, media, fonts
+and requests to hosts other than BBDC, since scanning only needs the
+bbdc-back-service JSON. Booking switches the page back to full fidelity.
+
+If Chromium crashes or is closed, every context on it fires "close" and the
+sessions drop their handles; the next `acquire` relaunches the browser.
+"""
+import asyncio
+import time
+from urllib.parse import urlsplit
+from bbdc_slot_finder.const import bbdc_chooseslot_url
+from bbdc_slot_finder.logger import logger
+
+# resource types a scan-only page does not load
+SCAN_BLOCKED_TYPES = ["image", "media", "font"]
+# hosts a scan-only page may talk to when third-party requests are blocked
+BBDC_HOSTS = ["booking.bbdc.sg"]
+
+
+class ScanRouteProfile(object):
+    def __init__(self, block_resources=SCAN_BLOCKED_TYPES, block_third_party=True):
+        """
+        Args:
+            block_resources (list): Playwright resource types to abort, e.g.
+                image, media, font, stylesheet. Blocking stylesheets breaks
+                the DOM month buttons and the booking dialog.
+            block_third_party (bool): abort requests to hosts outside BBDC_HOSTS.
+        """
+        self.block_resources = set(block_resources)
+        self.block_third_party = block_third_party
+        self.blocked = 0
+
+    def blocks(self, request) -> bool:
+        if request.resource_type in self.block_resources:
+            return True
+        if self.block_third_party and request.url.startswith("http"):
+            return urlsplit(request.url).hostname not in BBDC_HOSTS
+        return False
+
+    async def _handle(self, route, request):
+        if self.blocks(request):
+            self.blocked += 1
+            await route.abort()
+        else:
+            # let the jsessionid route (and the network) handle it
+            await route.fallback()
+
+    async def install(self, context):
+        await context.route("**/*", self._handle)
+
+    async def remove(self, context):
+        await context.unroute("**/*", self._handle)
+
+
+class _PooledPage(object):
+    def __init__(self, key, context, page):
+        self.key = key  # (directory, headless, debug)
+        self.context = context
+        self.page = page
+        self.last_used = time.monotonic()
+        self.requests = 0
+        self.closed = False
+        self.scan_only = False
+        context.on("request", self._count_request)
+        context.on("close", self._on_close)
+
+    def _count_request(self, request):
+        if "bbdc-back-service" in request.url:
+            self.requests += 1
+
+    def _on_close(self, context):
+        self.closed = True
+
+    def usable(self, idle_ttl, max_requests) -> bool:
+        return (
+            not self.closed
+            and not self.page.is_closed()
+            and "chooseSlot" in self.page.url
+            and self.requests < max_requests
+            and time.monotonic() - self.last_used < idle_ttl
+        )
+
+
+class BrowserManager(object):
+    def __init__(
+        self,
+        warm_pages=1,
+        idle_ttl=600,
+        max_requests=200,
+        block_resources=SCAN_BLOCKED_TYPES,
+        block_third_party=True,
+    ):
+        """
+        Args:
+            warm_pages (int): ready pages kept per user; 0 disables the pool.
+            idle_ttl (float): seconds a pooled page may sit unused.
+            max_requests (int): backend requests after which a page is
+                recycled instead of pooled again.
+            block_resources (list): resource types scan-only pages abort;
+                empty, with block_third_party off, to load everything.
+            block_third_party (bool): scan-only pages abort non-BBDC hosts.
+        """
+        self.warm_pages = warm_pages
+        self.idle_ttl = idle_ttl
+        self.max_requests = max_requests
+        self.scan_profile = None
+        if block_resources or block_third_party:
+            self.scan_profile = ScanRouteProfile(block_resources, block_third_party)
+        self._playwright = None
+        self._browsers = {}  # headless: Browser
+        self._lock = asyncio.Lock()
+        self._wanted = {}  # keys the pool is kept warm for: last acquire
+        self._idle = {}  # key: [_PooledPage]
+        self._leased = {}  # BrowserContext: _PooledPage
+        self._warming = {}  # key: number of pages being opened
+        self._tasks = set()
+        self._reaper = None
+
+    def __len__(self):
+        """Number of open contexts across all browsers."""
+        return sum(len(b.contexts) for b in self._browsers.values())
+
+    async def get_browser(self, headless=True):
+        """The shared Chromium for this headless mode, (re)launched if needed."""
+        from playwright.async_api import async_playwright
+        from bbdc_slot_finder.async_playwright_browser_ops import (
+            launch_bbdc_chromium,
+        )
+
+        async with self._lock:
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            browser = self._browsers.get(headless)
+            if browser is None or not browser.is_connected():
+                logger.info(f"launch shared chromium (headless={headless})")
+                browser = await launch_bbdc_chromium(self._playwright, headless)
+                browser.on(
+                    "disconnected",
+                    lambda b, headless=headless: self._on_disconnected(headless, b),
+                )
+                self._browsers[headless] = browser
+            return browser
+
+    def _on_disconnected(self, headless, browser):
+        if self._browsers.get(headless) is browser:
+            logger.warning(f"shared chromium (headless={headless}) disconnected")
+            del self._browsers[headless]
+
+    async def new_context(
+        self, directory, headless=True, debug=False, refresh_token=False
+    ):
+        """
+        Args:
+            directory (str): user directory holding auth.json and cookies.json
+        Returns:
+            (BrowserContext, Page)
+        """
+        from bbdc_slot_finder.async_playwright_browser_ops import new_bbdc_context
+
+        browser = await self.get_browser(headless)
+        try:
+            return await new_bbdc_context(browser, debug, directory, refresh_token)
+        except Exception:
+            if browser.is_connected():
+                raise
+            # chromium died between launch and new_context; relaunch once
+            browser = await self.get_browser(headless)
+            return await new_bbdc_context(browser, debug, directory, refresh_token)
+
+    async def _open(self, key, wait=False):
+        """New page on the chooseSlot page; with wait, until the SPA has loaded
+        the released slots."""
+        directory, headless, debug = key
+        context, page = await self.new_context(directory, headless, debug)
+        entry = _PooledPage(key, context, page)
+        try:
+            await self.set_scan_only(entry, True)
+            if wait:
+                async with page.expect_response(
+                    "**/listC3PracticalSlotReleased", timeout=30000
+                ):
+                    await page.goto(bbdc_chooseslot_url)
+            else:
+                await page.goto(bbdc_chooseslot_url)
+        except Exception:
+            await self._close(entry)
+            raise
+        return entry
+
+    async def set_scan_only(self, entry, scan_only=True):
+        """Install or remove the scan route profile on a page's context."""
+        if self.scan_profile is None or entry.scan_only == scan_only:
+            return
+        if scan_only:
+            await self.scan_profile.install(entry.context)
+        else:
+            await self.scan_profile.remove(entry.context)
+        entry.scan_only = scan_only
+
+    async def full_fidelity(self, context):
+        """Load every resource on this page again, e.g. before booking."""
+        entry = self._leased.get(context)
+        if entry is not None:
+            await self.set_scan_only(entry, False)
+
+    async def _close(self, entry):
+        entry.closed = True
+        try:
+            await entry.context.close()
+        except Exception:
+            pass
+
+    async def acquire(self, directory, headless=True, debug=False, scan_only=True):
+        """
+        A page for this user on the chooseSlot page, from the pool if one is
+        ready, and keeps the pool warm for the user from now on.
+        Args:
+            scan_only (bool): keep the scan route profile on the page; False
+                for pages a person will look at.
+        Returns:
+            (BrowserContext, Page)
+        """
+        key = (directory, headless, debug)
+        self._wanted[key] = time.monotonic()
+        idle = self._idle.setdefault(key, [])
+        entry = None
+        while idle:
+            candidate = idle.pop()
+            if candidate.usable(self.idle_ttl, self.max_requests):
+                entry = candidate
+                logger.debug(f"warm page for {directory}")
+                break
+            await self._close(candidate)
+        if entry is None:
+            entry = await self._open(key)
+        await self.set_scan_only(entry, scan_only)
+        self._leased[entry.context] = entry
+        self._replenish(key)
+        self._start_reaper()
+        return entry.context, entry.page
+
+    async def release(self, context, discard=False):
+        """
+        Hand a page back to the pool.
+        Args:
+            discard (bool): the user's login is no longer valid; close this
+                and every pooled page of the user and stop warming for them.
+        """
+        entry = self._leased.pop(context, None)
+        if entry is None:
+            try:
+                await context.close()
+            except Exception:
+                pass
+            return
+        if discard:
+            await self.discard(entry.key[0])
+            await self._close(entry)
+            return
+        entry.last_used = time.monotonic()
+        idle = self._idle.setdefault(entry.key, [])
+        if (
+            entry.key in self._wanted
+            and len(idle) < self.warm_pages
+            and entry.usable(self.idle_ttl, self.max_requests)
+        ):
+            try:
+                await self.set_scan_only(entry, True)
+                idle.append(entry)
+            except Exception:
+                await self._close(entry)
+        else:
+            await self._close(entry)
+        self._replenish(entry.key)
+
+    async def discard(self, directory):
+        """Close the pooled pages of a user, e.g. after the login expired."""
+        for key in [k for k in self._wanted if k[0] == directory]:
+            del self._wanted[key]
+        for key in [k for k in self._idle if k[0] == directory]:
+            for entry in self._idle.pop(key):
+                await self._close(entry)
+
+    def forget(self, directory):
+        """Stop keeping pages warm for a user, e.g. when their camp job ends."""
+        if any(k[0] == directory for k in list(self._wanted) + list(self._idle)):
+            self._spawn(self.discard(directory))
+
+    def _replenish(self, key):
+        if key not in self._wanted:
+            return
+        missing = (
+            self.warm_pages
+            - len(self._idle.get(key, []))
+            - self._warming.get(key, 0)
+        )
+        for _ in range(missing):
+            self._spawn(self._warm(key))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _warm(self, key):
+        self._warming[key] = self._warming.get(key, 0) + 1
+        try:
+            entry = await self._open(key, wait=True)
+        except Exception as e:
+            logger.warning(f"failed to warm a page for {key[0]}: {e}")
+            return
+        finally:
+            self._warming[key] -= 1
+        idle = self._idle.setdefault(key, [])
+        if key in self._wanted and len(idle) < self.warm_pages:
+            idle.append(entry)
+        else:
+            await self._close(entry)
+
+    def _start_reaper(self):
+        if self.warm_pages and (self._reaper is None or self._reaper.done()):
+            self._reaper = self._spawn(self._reap())
+
+    async def _reap(self):
+        # recycle pooled pages that went stale, crashed or left chooseSlot;
+        # users idle for idle_ttl are no longer warmed
+        while self._wanted:
+            await asyncio.sleep(max(self.idle_ttl / 4, 5))
+            now = time.monotonic()
+            for key, acquired in list(self._wanted.items()):
+                if now - acquired >= self.idle_ttl:
+                    logger.debug(f"stop warming pages for idle {key[0]}")
+                    del self._wanted[key]
+            for key, idle in list(self._idle.items()):
+                for entry in list(idle):
+                    if key not in self._wanted or not entry.usable(
+                        self.idle_ttl, self.max_requests
+                    ):
+                        idle.remove(entry)
+                        await self._close(entry)
+                if not idle and key not in self._wanted:
+                    del self._idle[key]
+                self._replenish(key)
+
+    async def close(self):
+        self._wanted.clear()
+        for task in list(self._tasks):
+            task.cancel()
+        for idle in self._idle.values():
+            for entry in idle:
+                await self._close(entry)
+        self._idle.clear()
+        self._leased.clear()
+        async with self._lock:
+            for browser in list(self._browsers.values()):
+                try:
+                    await browser.close()
+                except Exception:
+                    pass
+            self._browsers.clear()
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+
+_manager = None
+
+
+def configure_browser_manager(**kwargs) -> BrowserManager:
+    """Set up the process-wide manager, e.g. from the `browser` bot config."""
+    global _manager
+    _manager = BrowserManager(**kwargs)
+    return _manager
+
+
+def get_browser_manager() -> BrowserManager:
+    global _manager
+    if _manager is None:
+        _manager = BrowserManager()
+    return _manager
+
+
+async def close_browser_manager():
+    """Shut the shared browsers down, if they were ever started."""
+    if _manager is not None:
+        await _manager.close()
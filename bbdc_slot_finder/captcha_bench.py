@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+# coding: utf-8
+"""
+Offline captcha benchmark.
+
+Replays the captchas logged to logs/captcha.txt through the solvers (line,
+chars, multi) and reports per-stage timings, latency percentiles, throughput,
+the rate of 5-character answers and, given a label file, the accuracy.
+
+    python -m bbdc_slot_finder.captcha_bench [--labels labels.csv]
+
+The label file is a CSV with a `line,answer` header, where line is the
+0-based line number of the captcha in the captcha file.
+"""
+import argparse
+import csv
+import math
+import time
+from bbdc_slot_finder.auto_decoder import (
+    base64img,
+    divide_and_conquer_ocr,
+    preprocess_captcha,
+    solve_captcha,
+    solve_captcha_multi,
+)
+
+STAGES = ["decode", "colour_filter", "denoise", "threshold", "segment", "ocr"]
+
+
+def solve_line(bio, timings):
+    return solve_captcha(bio, timings=timings)[0]
+
+
+def solve_chars(bio, timings):
+    return divide_and_conquer_ocr(preprocess_captcha(bio, timings), timings)
+
+
+def solve_multi(bio, timings):
+    return solve_captcha_multi(bio, timings=timings)[0]
+
+
+SOLVERS = {"line": solve_line, "chars": solve_chars, "multi": solve_multi}
+
+
+def load_captchas(captcha_file="logs/captcha.txt"):
+    with open(captcha_file, "r") as f:
+        return [i.strip() for i in f.readlines() if i.strip()]
+
+
+def load_labels(label_file):
+    """Read a `line,answer` CSV into {line number: answer}."""
+    with open(label_file, "r", newline="") as f:
+        return {int(row["line"]): row["answer"].strip() for row in csv.DictReader(f)}
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0.0
+    rank = max(math.ceil(q / 100 * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def run_benchmark(captchas, solver="line", labels=None):
+    """
+    Args:
+        captchas (list): base64 captcha payloads
+        solver (str): key of SOLVERS
+        labels (dict, optional): {line number: answer}
+    Returns:
+        dict of results, see format_report
+    """
+    solve = SOLVERS[solver]
+    stage_totals = {}
+    latencies = []
+    hits = correct = labelled = 0
+    started = time.perf_counter()
+    for n, payload in enumerate(captchas):
+        timings = {}
+        start = time.perf_counter()
+        bio = base64img(payload)
+        timings["decode"] = time.perf_counter() - start
+        answer = solve(bio, timings)
+        latencies.append(time.perf_counter() - start)
+        for stage, seconds in timings.items():
+            stage_totals[stage] = stage_totals.get(stage, 0) + seconds
+        hits += len(answer) == 5
+        if labels and n in labels:
+            labelled += 1
+            correct += answer == labels[n]
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    count = len(captchas)
+    return {
+        "solver": solver,
+        "count": count,
+        "stages": {k: stage_totals[k] / count for k in STAGES if k in stage_totals},
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "throughput": count / elapsed if elapsed else 0.0,
+        "hit_rate": hits / count if count else 0.0,
+        "labelled": labelled,
+        "accuracy": correct / labelled if labelled else None,
+    }
+
+
+def format_report(result):
+    lines = [f"== {result['solver']} solver, {result['count']} captchas"]
+    for stage, seconds in result["stages"].items():
+        lines.append(f"  {stage:<14}{seconds * 1000:9.2f} ms")
+    lines.append(
+        "  latency p50/p95/p99: "
+        + " / ".join(f"{result[k] * 1000:.1f}" for k in ["p50", "p95", "p99"])
+        + " ms"
+    )
+    lines.append(f"  throughput: {result['throughput']:.1f} images/s")
+    lines.append(f"  length-5 hit rate: {result['hit_rate']:.1%}")
+    if result["accuracy"] is not None:
+        lines.append(
+            f"  accuracy: {result['accuracy']:.1%} ({result['labelled']} labelled)"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        "-c", "--captchas", default="logs/captcha.txt", help="logged captcha file"
+    )
+    argparser.add_argument("-l", "--labels", help="CSV with line,answer columns")
+    argparser.add_argument(
+        "-s",
+        "--solver",
+        choices=list(SOLVERS) + ["all"],
+        default="all",
+        help="solver to benchmark",
+    )
+    argparser.add_argument("-n", "--limit", type=int, help="only use the first N")
+    args = argparser.parse_args()
+    captchas = load_captchas(args.captchas)[: args.limit]
+    labels = load_labels(args.labels) if args.labels else None
+    solvers = list(SOLVERS) if args.solver == "all" else [args.solver]
+    for solver in solvers:
+        print(format_report(run_benchmark(captchas, solver, labels)))
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# coding: utf-8
+"""
+LRU cache of solved captchas keyed by a hash of the image payload.
+
+Answers the server accepted are reused without OCR; answers it rejected
+("Incorrect Captcha") are remembered so the same wrong text is never sent
+twice for the same image. The cache is kept in a small json file so it
+survives restarts.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from bbdc_slot_finder.logger import logger
+
+
+def captcha_key(captcha_data) -> str:
+    """Hash of the base64 payload of a captcha json ({"image": "data:...,..."})."""
+    img_data = captcha_data["image"].split(",")[-1]
+    return hashlib.sha1(img_data.encode()).hexdigest()
+
+
+class CaptchaCache(object):
+    def __init__(self, path="logs/captcha_cache.json", maxsize=512):
+        """
+        Args:
+            path (str): json file the cache is persisted to; None to keep it
+                in memory only.
+            maxsize (int): number of images remembered.
+        """
+        self.path = path
+        self.maxsize = maxsize
+        # key: {"text": last answer, "accepted": True/False/None, "rejected": [...]}
+        self._entries = OrderedDict()
+        self._save_lock = threading.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def accepted_answer(self, key):
+        """The answer the server accepted for this image, if any."""
+        entry = self.get(key)
+        if entry and entry["accepted"]:
+            return entry["text"]
+        return None
+
+    def is_rejected(self, key, text) -> bool:
+        entry = self._entries.get(key)
+        return bool(entry) and text in entry["rejected"]
+
+    def put(self, key, text):
+        """Record the answer about to be submitted for this image."""
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = {"text": text, "accepted": None, "rejected": []}
+        else:
+            entry["text"] = text
+            entry["accepted"] = None
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def mark(self, key, accepted: bool, save=True):
+        """Record the server's verdict on the last answer put for this image.
+        Returns whether the cache changed (and should be saved)."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return False
+        if accepted:
+            entry["accepted"] = True
+        else:
+            entry["accepted"] = False
+            if entry["text"] not in entry["rejected"]:
+                entry["rejected"].append(entry["text"])
+        if save:
+            self.save()
+        return True
+
+    def load(self):
+        if not self.path or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                self._entries = OrderedDict(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f"failed to load captcha cache: {e}")
+
+    def dumps(self) -> str:
+        return json.dumps(self._entries)
+
+    def save(self, text=None):
+        """Write the cache, or a dumps() snapshot of it (e.g. from a thread).
+        The file is replaced whole, so a reader never sees a partial write."""
+        if not self.path:
+            return
+        if text is None:
+            text = self.dumps()
+        tmp = f"{self.path}.tmp"
+        with self._save_lock:
+            try:
+                with open(tmp, "w") as f:
+                    f.write(text)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                logger.warning(f"failed to save captcha cache: {e}")
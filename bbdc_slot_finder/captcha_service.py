@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+# coding: utf-8
+"""
+Captcha solving off the event loop.
+
+auto_solve_captcha_data is CPU and OCR work; running it inside a coroutine
+stalls every other chat. CaptchaService runs it in a process (or thread) pool
+and exposes `await solve(captcha_data)` with a bounded number of pending
+requests and a per-request timeout.
+"""
+import asyncio
+import concurrent.futures
+import threading
+from concurrent.futures.process import BrokenProcessPool
+from bbdc_slot_finder.captcha_cache import CaptchaCache, captcha_key
+from bbdc_slot_finder.exceptions import CaptchaServiceBusy
+from bbdc_slot_finder.logger import logger
+
+
+def _warm_up_worker():
+    # load the OCR engine once per worker instead of on the first captcha
+    from bbdc_slot_finder.ocr import get_ocr_backend
+
+    try:
+        get_ocr_backend()
+    except Exception as e:
+        logger.warning(f"OCR backend failed to load in worker: {e}")
+
+
+class CaptchaService(object):
+    def __init__(
+        self,
+        executor="process",
+        workers=2,
+        max_pending=8,
+        timeout=15,
+        mode="single",
+        cache_file="logs/captcha_cache.json",
+        cache_size=512,
+    ):
+        """
+        Args:
+            executor (str): "process" or "thread".
+            workers (int): number of pool workers.
+            max_pending (int): requests allowed in the pool (running + queued);
+                further requests raise CaptchaServiceBusy.
+            timeout (float): seconds to wait for one solve.
+            mode (str): "single" runs one OCR pass; "multi" tries the
+                CAPTCHA_VARIANTS concurrently and keeps the most confident.
+            cache_file (str): where solved captchas are persisted; None for
+                an in-memory cache.
+            cache_size (int): number of solved captchas remembered.
+        """
+        if executor not in ("process", "thread"):
+            raise ValueError(f"Unknown captcha executor: {executor}")
+        self.executor = executor
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.mode = mode
+        self.cache = CaptchaCache(cache_file, cache_size)
+        self._pool = None
+        self._saver = None  # one thread, so cache writes land in order
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None:
+            if self.executor == "process":
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=_warm_up_worker
+                )
+            else:
+                self._pool = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="captcha"
+                )
+        return self._pool
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, func, *args):
+        """Run func(*args) in the pool under the queue bound and timeout."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise CaptchaServiceBusy(f"{self._pending} captcha requests pending")
+            self._pending += 1
+        try:
+            pool = self._get_pool()
+            try:
+                future = pool.submit(func, *args)
+            except BrokenProcessPool:
+                # a worker died while the pool was idle; nothing ran yet, so
+                # submit once more to a fresh pool
+                self._reset_pool(pool)
+                pool = self._get_pool()
+                future = pool.submit(func, *args)
+        except BrokenProcessPool:
+            self._release(None)
+            self._reset_pool(pool)
+            raise
+        except BaseException:
+            self._release(None)
+            raise
+        # a timed-out job keeps its worker busy, so it is only released from
+        # the pending count once it actually finishes
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except BrokenProcessPool:
+            self._reset_pool(pool)
+            raise
+
+    def _reset_pool(self, pool):
+        """Drop a broken pool so the next request starts a fresh one; a pool
+        another request already replaced it with is left alone."""
+        if self._pool is not pool:
+            return
+        # a worker died (e.g. OOM)
+        logger.error("captcha worker pool broken, restarting")
+        self._pool = None
+        pool.shutdown(wait=False)
+
+    async def solve(self, captcha_data) -> str:
+        """
+        Solve a captcha json payload ({"image": "data:...;base64,..."}).
+        An answer the server already accepted for the same image is returned
+        without OCR; an answer it rejected is never returned again ("" instead,
+        so the caller refreshes the image). Report the server's verdict with
+        report(captcha_key(captcha_data), accepted).
+        """
+        from bbdc_slot_finder.auto_decoder import auto_solve_captcha_data
+
+        key = captcha_key(captcha_data)
+        captcha = self.cache.accepted_answer(key)
+        if captcha is not None:
+            logger.info("captcha answered from cache")
+            return captcha
+        captcha = await self.run(auto_solve_captcha_data, captcha_data, self.mode)
+        if self.cache.is_rejected(key, captcha):
+            logger.info(f"captcha answer {captcha} was rejected before, skip it")
+            return ""
+        if captcha:
+            self.cache.put(key, captcha)
+        return captcha
+
+    def report(self, key, accepted: bool):
+        """Record whether the server accepted the last answer for a captcha;
+        from the loop, the cache file is written by a single writer thread, one
+        snapshot after the other."""
+        if key is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.cache.mark(key, accepted)
+            return
+        if self.cache.mark(key, accepted, save=False):
+            if self._saver is None:
+                self._saver = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="captcha-cache"
+                )
+            loop.run_in_executor(self._saver, self.cache.save, self.cache.dumps())
+
+    def shutdown(self, wait=False):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+        if self._saver is not None:
+            # pending cache writes still finish
+            self._saver.shutdown(wait=wait)
+            self._saver = None
+
+
+_service = None
+
+
+def configure_captcha_service(**kwargs) -> CaptchaService:
+    """Replace the process-wide service, e.g. from the `captcha` bot config."""
+    global _service
+    if _service is not None:
+        _service.shutdown()
+    _service = CaptchaService(**kwargs)
+    return _service
+
+
+def get_captcha_service() -> CaptchaService:
+    global _service
+    if _service is None:
+        _service = CaptchaService()
+    return _service
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+# coding: utf-8
+"""
+Nearest-neighbour classifier for single captcha characters.
+
+Templates are the character crops of labelled captchas, normalised to a small
+fixed-size grid and stored in a compressed .npz file. Classifying a crop is a
+single matrix product, so confident characters never reach Tesseract.
+
+Train from the logged captchas and a `line,answer` label CSV:
+
+    python -m bbdc_slot_finder.char_classifier -l labels.csv
+"""
+import os
+import argparse
+import numpy as np
+from bbdc_slot_finder.logger import logger
+
+CHAR_MODEL = os.environ.get("BBDC_CHAR_MODEL", "logs/char_templates.npz")
+CROP_SIZE = (16, 20)  # width, height
+# relative gap between the best and the runner-up class; below it, use OCR
+MIN_MARGIN = 0.25
+# mean squared pixel distance (0 to 1) above which no template is close enough
+MAX_DISTANCE = 0.05
+
+
+def normalise_crop(char_image):
+    """Trim a white-on-black crop to its ink and resize it to CROP_SIZE."""
+    import cv2
+
+    ys, xs = np.nonzero(char_image)
+    if len(ys):
+        char_image = char_image[ys.min() : ys.max() + 1, xs.min() : xs.max() + 1]
+    resized = cv2.resize(char_image, CROP_SIZE, interpolation=cv2.INTER_AREA)
+    return resized.astype(np.uint8).ravel()
+
+
+class CharClassifier(object):
+    def __init__(self, templates, labels):
+        """
+        Args:
+            templates (np.ndarray): (n, width * height) uint8 normalised crops
+            labels (np.ndarray): (n,) single-character labels
+        """
+        self.templates = np.asarray(templates, dtype=np.uint8)
+        self.labels = np.asarray(labels)
+        vectors = self.templates.astype(np.float32) / 255
+        self._vectors = vectors
+        self._norms = (vectors**2).sum(axis=1)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def classify(self, char_image):
+        """
+        Returns:
+            (char, margin): the nearest template's label, and how much closer
+            it is than the nearest template of any other label (0 to 1).
+            margin is 0 if even the nearest template is further than
+            MAX_DISTANCE, e.g. for a character missing from the templates.
+        """
+        vector = normalise_crop(char_image).astype(np.float32) / 255
+        distances = self._norms - 2 * self._vectors @ vector + (vector**2).sum()
+        order = np.argsort(distances)
+        best = order[0]
+        char = str(self.labels[best])
+        others = order[self.labels[order] != char]
+        d_best = max(float(distances[best]), 0.0)
+        if d_best / vector.size > MAX_DISTANCE:
+            return char, 0.0
+        if not len(others):
+            return char, 1.0
+        d_other = max(float(distances[others[0]]), 1e-6)
+        return char, max(d_other - d_best, 0.0) / d_other
+
+    def save(self, path=CHAR_MODEL):
+        np.savez_compressed(path, templates=self.templates, labels=self.labels)
+
+    @classmethod
+    def load(cls, path=CHAR_MODEL):
+        with np.load(path) as data:
+            return cls(data["templates"], data["labels"])
+
+    @classmethod
+    def train(cls, captchas, labels):
+        """
+        Build templates from labelled captchas. Captchas whose segmentation
+        does not yield one crop per answer character are skipped.
+        Args:
+            captchas (list): base64 captcha payloads
+            labels (dict): {index in captchas: answer}
+        """
+        from bbdc_slot_finder.auto_decoder import (
+            base64img,
+            preprocess_captcha,
+            segment_characters,
+        )
+
+        templates, chars = [], []
+        skipped = 0
+        for n, answer in labels.items():
+            if n >= len(captchas):
+                continue
+            crops = segment_characters(preprocess_captcha(base64img(captchas[n])))
+            if len(crops) != len(answer):
+                skipped += 1
+                continue
+            for crop, char in zip(crops, answer):
+                templates.append(normalise_crop(crop))
+                chars.append(char)
+        logger.info(f"{len(chars)} character templates, {skipped} captchas skipped")
+        if not templates:
+            raise ValueError("No usable labelled captchas")
+        return cls(np.stack(templates), np.array(chars))
+
+
+_classifier = None
+
+
+def get_char_classifier(path=None):
+    """Load the trained templates once; None if no model file exists."""
+    global _classifier
+    if _classifier is None:
+        path = path or CHAR_MODEL
+        if not os.path.isfile(path):
+            return None
+        _classifier = CharClassifier.load(path)
+        logger.info(f"Loaded {len(_classifier)} character templates from {path}")
+    return _classifier
+
+
+if __name__ == "__main__":
+    from bbdc_slot_finder.captcha_bench import load_captchas, load_labels
+
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        "-c", "--captchas", default="logs/captcha.txt", help="logged captcha file"
+    )
+    argparser.add_argument(
+        "-l", "--labels", required=True, help="CSV with line,answer columns"
+    )
+    argparser.add_argument("-o", "--output", default=CHAR_MODEL)
+    args = argparser.parse_args()
+    classifier = CharClassifier.train(
+        load_captchas(args.captchas), load_labels(args.labels)
+    )
+    classifier.save(args.output)
+    print(f"-- Saved {len(classifier)} templates to {args.output}")
@@ -1,4 +1,5 @@
 bbdc_base_url = "https://booking.bbdc.sg/bbdc-back-service/api/"
+bbdc_chooseslot_url = "https://booking.bbdc.sg/?#/booking/chooseSlot?courseType=3C&insInstructorId=&instructorType="
 auth_checkIdAndPass = "auth/checkIdAndPass"
 auth_getLoginCaptchaImage = "auth/getLoginCaptchaImage"
 auth_Login = "auth/login"
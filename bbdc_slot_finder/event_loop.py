@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+# coding: utf-8
+"""
+Keeping the event loop free.
+
+Every chat's handlers, campers and the Telegram polling share one asyncio
+loop, so anything that blocks it (time.sleep, file writes, spawning a shell)
+stalls all users at once. Blocking work goes through run_blocking (a worker
+thread) instead; `say` speaks without waiting for the speech to finish.
+
+In debug mode the bot also runs a LoopWatchdog: a thread that expects a
+heartbeat from the loop every few milliseconds and, when the loop has been
+stuck for longer than the threshold, logs the stack of whatever the loop
+thread is running, so the offender can be found and moved off the loop.
+"""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from bbdc_slot_finder.logger import logger
+
+# spoken alerts still running, kept so they are not garbage collected
+_speech = set()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """func(*args, **kwargs) in a worker thread."""
+    return await asyncio.to_thread(func, *args, **kwargs)
+
+
+def _append(path, text):
+    with open(path, "a+") as f:
+        f.write(text)
+
+
+async def append_to_file(path, text):
+    """Append text to a (log) file without blocking the loop."""
+    try:
+        await run_blocking(_append, path, text)
+    except OSError as e:
+        logger.warning(f"failed to write {path}: {e}")
+
+
+async def _say(args):
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "say",
+            *args,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        await process.wait()
+    except OSError:
+        pass  # no `say` (not macOS)
+
+
+def say(text, voice=None):
+    """Speak an alert with macOS `say` in the background."""
+    args = (["-v", voice] if voice else []) + [text]
+    task = asyncio.ensure_future(_say(args))
+    _speech.add(task)
+    task.add_done_callback(_speech.discard)
+
+
+class LoopWatchdog(object):
+    def __init__(self, threshold=0.2, interval=0.05):
+        """
+        Args:
+            threshold (float): seconds the loop may be stuck before its
+                stack is logged
+            interval (float): seconds between heartbeats
+        """
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._loop_thread = None
+        self._heartbeat = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    async def _beat_forever(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        reported = None  # beat of the stall already logged
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            stuck = time.monotonic() - beat
+            if stuck < self.threshold or beat == reported:
+                continue
+            reported = beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame else "?"
+            logger.warning(
+                f"event loop blocked for {stuck * 1000:.0f} ms, in:\n{stack}"
+            )
+
+    def start(self):
+        """Start watching the running loop."""
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = asyncio.ensure_future(self._beat_forever())
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._thread.start()
+        logger.info(f"event loop watchdog on, threshold {self.threshold * 1000:.0f} ms")
+
+    def stop(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        if self.stalls:
+            logger.info(f"event loop watchdog: {self.stalls} stalls")
+
+
+_watchdog = None
+
+
+def start_loop_watchdog(**kwargs) -> LoopWatchdog:
+    """Watch the running loop, e.g. from the bot's post_init in debug mode."""
+    global _watchdog
+    if _watchdog is None:
+        _watchdog = LoopWatchdog(**kwargs)
+        _watchdog.start()
+    return _watchdog
+
+
+def stop_loop_watchdog():
+    global _watchdog
+    if _watchdog is not None:
+        _watchdog.stop()
+        _watchdog = None
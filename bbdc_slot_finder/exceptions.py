@@ -17,3 +17,7 @@ class TokenExpireError(Exception):
 
 class SessionStopError(Exception):
     pass
+
+
+class CaptchaServiceBusy(Exception):
+    pass
@@ -0,0 +1,308 @@
+#!/usr/bin/python3
+# coding: utf-8
+"""
+Browserless HTTP client for the bbdc-back-service.
+
+Scanning only needs the back-service JSON, and a logged-in user's
+headers.json (authorization, jsessionid) and cookies.json (bbdc-token) are
+all the back-service asks for. BbdcHttpClient sends the requests of one
+account without a browser, so an account costs a few bytes of auth instead of
+a Chromium page; the browser is only needed to log in and, for the DOM
+booking path, to book.
+
+All accounts send their requests through one process-wide HttpTransport: a
+single httpx AsyncClient whose connection pool (HTTP/2, keep-alive) is capped
+at `max_connections` to booking.bbdc.sg, with one shared SSL context and a
+DNS cache. Polls of all users are multiplexed over the same few connections,
+so TLS handshakes and lookups are paid once per connection instead of once
+per request or per user. The shared client holds no credentials and keeps no
+cookies; every request carries the headers and cookies of its own account.
+
+The per-account client mimics the part of Playwright's APIRequestContext that
+BbdcApi uses (`post(url, headers=, data=)` returning a response with `ok`,
+`url`, `json()` and `text()`), so the request helpers work with either.
+
+A response that says the login is no longer valid raises TokenExpireError;
+other error statuses raise httpx.HTTPStatusError, so a flaky connection is not
+mistaken for an expired login.
+"""
+import asyncio
+import http.cookiejar
+import socket
+import ssl
+import time
+import httpcore
+import httpx
+from bbdc_slot_finder.const import bbdc_base_url
+from bbdc_slot_finder.exceptions import TokenExpireError
+from bbdc_slot_finder.logger import logger
+
+# headers of a captured browser request that must not be replayed
+SKIPPED_HEADERS = [
+    "content-length",
+    "content-type",
+    "cookie",
+    "host",
+    "connection",
+    "accept-encoding",
+]
+# back-service codes / messages of an expired or invalid login
+TOKEN_EXPIRED_CODES = [401, 403]
+TOKEN_EXPIRED_WORDS = ["token", "login", "expire", "unauthori"]
+
+
+def auth_headers(headers: dict) -> dict:
+    """Request headers of headers.json that can be sent by another client."""
+    return {
+        k: v
+        for k, v in (headers or {}).items()
+        if not k.startswith(":") and k.lower() not in SKIPPED_HEADERS
+    }
+
+
+def is_token_expired(status: int, body: dict) -> bool:
+    """Whether a back-service response means the login has to be renewed."""
+    if status in TOKEN_EXPIRED_CODES:
+        return True
+    if not isinstance(body, dict) or body.get("success", True):
+        return False
+    if body.get("code") in TOKEN_EXPIRED_CODES:
+        return True
+    message = str(body.get("message") or "").lower()
+    return any(word in message for word in TOKEN_EXPIRED_WORDS)
+
+
+class _DnsCache(httpcore.AsyncNetworkBackend):
+    """httpcore network backend that reuses host lookups for `ttl` seconds."""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._backend = httpcore.AnyIOBackend()
+        self._hosts = {}  # (host, port): (resolved at, [addresses])
+        self.lookups = 0
+
+    async def resolve(self, host, port) -> list:
+        cached = self._hosts.get((host, port))
+        if cached and time.monotonic() - cached[0] < self.ttl:
+            return cached[1]
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            host, port, type=socket.SOCK_STREAM
+        )
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        self._hosts[(host, port)] = (time.monotonic(), addresses)
+        self.lookups += 1
+        return addresses
+
+    def forget(self, host, port):
+        self._hosts.pop((host, port), None)
+
+    async def connect_tcp(
+        self, host, port, timeout=None, local_address=None, socket_options=None
+    ):
+        error = None
+        for address in await self.resolve(host, port):
+            try:
+                # TLS still verifies and sends SNI for `host`
+                return await self._backend.connect_tcp(
+                    address, port, timeout, local_address, socket_options
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        # the host may have moved: look it up again next time
+        self.forget(host, port)
+        raise error or httpcore.ConnectError(f"no address for {host}")
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds):
+        await self._backend.sleep(seconds)
+
+
+class _PooledTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, ssl_context, limits, http2, retries, network_backend):
+        super().__init__(verify=ssl_context, http2=http2, limits=limits)
+        # same pool as httpx builds, with the DNS cache as network backend
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=ssl_context,
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            http1=True,
+            http2=http2,
+            retries=retries,
+            network_backend=network_backend,
+        )
+
+
+class HttpTransport(object):
+    def __init__(
+        self,
+        max_connections=10,
+        max_keepalive=5,
+        keepalive_expiry=60,
+        http2=True,
+        timeout=15,
+        retries=1,
+        dns_ttl=300,
+    ):
+        """
+        Args:
+            max_connections (int): open connections to booking.bbdc.sg, for
+                all accounts together; further requests wait for a free one
+            max_keepalive (int): idle connections kept open
+            keepalive_expiry (float): seconds an idle connection is kept
+            http2 (bool): multiplex concurrent requests over one connection
+            timeout (float): seconds per request
+            retries (int): connection attempts retried
+            dns_ttl (float): seconds a host lookup is reused
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2
+        self.timeout = timeout
+        self.retries = retries
+        self.dns = _DnsCache(dns_ttl)
+        self._client = None
+        self.requests = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            transport = _PooledTransport(
+                ssl.create_default_context(),
+                self.limits,
+                self.http2,
+                self.retries,
+                self.dns,
+            )
+            # cookies belong to accounts, never to the shared client
+            no_cookies = http.cookiejar.CookieJar(
+                http.cookiejar.DefaultCookiePolicy(allowed_domains=[])
+            )
+            self._client = httpx.AsyncClient(
+                base_url=bbdc_base_url,
+                transport=transport,
+                timeout=self.timeout,
+                cookies=no_cookies,
+            )
+        return self._client
+
+    async def post(self, url, headers: dict, cookies: dict, data: dict = None):
+        """Send one account's request, with its headers and cookies."""
+        headers = dict(headers)
+        if cookies:
+            headers["cookie"] = "; ".join(f"{k}={v}" for k, v in cookies.items())
+        self.requests += 1
+        return await self.client.post(url, headers=headers, json=data)
+
+    def report(self) -> str:
+        return (
+            f"http transport: {self.requests} requests, "
+            f"{self.dns.lookups} DNS lookups"
+        )
+
+    async def close(self):
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aclose()
+            logger.info(self.report())
+
+
+_transport = None
+
+
+def configure_http_transport(**kwargs) -> HttpTransport:
+    """Set up the process-wide transport, e.g. from the `http` bot config."""
+    global _transport
+    _transport = HttpTransport(**kwargs)
+    return _transport
+
+
+def get_http_transport() -> HttpTransport:
+    global _transport
+    if _transport is None:
+        _transport = HttpTransport()
+    return _transport
+
+
+async def close_http_transport():
+    """Close the shared connections, if any were opened."""
+    if _transport is not None:
+        await _transport.close()
+
+
+class HttpResponse(object):
+    """httpx response behind the Playwright APIResponse interface."""
+
+    def __init__(self, response):
+        self._response = response
+
+    @property
+    def ok(self) -> bool:
+        return self._response.is_success
+
+    @property
+    def status(self) -> int:
+        return self._response.status_code
+
+    @property
+    def url(self) -> str:
+        return str(self._response.url)
+
+    async def json(self):
+        return self._response.json()
+
+    async def text(self):
+        return self._response.text
+
+
+class BbdcHttpClient(object):
+    def __init__(self, headers: dict, cookies: list = None):
+        """
+        Args:
+            headers (dict): the user's headers.json
+            cookies (list): the user's cookies.json, Playwright cookie dicts
+        """
+        self.update_auth(headers, cookies)
+
+    def update_auth(self, headers: dict, cookies: list = None):
+        """Use a renewed login."""
+        self.headers = auth_headers(headers)
+        self.cookies = {c["name"]: c["value"] for c in cookies or []}
+
+    async def post(self, url, headers: dict = None, data: dict = None):
+        """
+        Args:
+            url (str): endpoint, relative to bbdc_base_url
+            headers (dict): extra request headers, e.g. the user's headers
+            data (dict): JSON body
+        Returns:
+            HttpResponse
+        Raises:
+            TokenExpireError: the back-service rejected the login
+            httpx.HTTPStatusError: any other error status
+        """
+        response = await get_http_transport().post(
+            url, dict(self.headers, **auth_headers(headers)), self.cookies, data
+        )
+        # cookies the server renews (e.g. the session id) stay with this account
+        self.cookies.update(response.cookies)
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        if is_token_expired(response.status_code, body):
+            message = body.get("message", "") if isinstance(body, dict) else ""
+            raise TokenExpireError(message or f"HTTP {response.status_code}")
+        # unlike Playwright, a server error is raised: it says nothing about the login
+        response.raise_for_status()
+        return HttpResponse(response)
+
+    async def aclose(self):
+        # the connections are shared; only the account's auth goes away
+        self.headers = {}
+        self.cookies = {}
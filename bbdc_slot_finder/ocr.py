@@ -0,0 +1,175 @@
+#!/usr/bin/python3
+# coding: utf-8
+"""
+OCR backends for captcha solving.
+
+TesserocrBackend keeps a Tesseract engine loaded in-process and reuses it for
+every captcha; TesseractSubprocessBackend shells out through pytesseract and is
+used when tesserocr is not installed. Choose with BBDC_OCR_BACKEND
+(auto / tesserocr / subprocess), default auto.
+"""
+import os
+import threading
+from bbdc_slot_finder.logger import logger
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+OCR_BACKEND = os.environ.get("BBDC_OCR_BACKEND", "auto")
+CHAR_WHITELIST = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+CHAR_BLACKLIST = "!?"
+PSM_LINE = 7
+PSM_CHAR = 10
+
+
+class OCRBackend(object):
+    name = "base"
+
+    def recognise(self, image, psm=PSM_LINE):
+        """
+        Read the first word of a captcha image.
+        Args:
+            image: PIL image
+            psm: tesseract page segmentation mode, 7 for a line, 10 for a char
+        Returns:
+            (text, confidence); ("", -1) if nothing was read
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class TesseractSubprocessBackend(OCRBackend):
+    """Spawn the tesseract binary through pytesseract for every image."""
+
+    name = "subprocess"
+
+    def __init__(self):
+        import pytesseract
+
+        self._pytesseract = pytesseract
+
+    def recognise(self, image, psm=PSM_LINE):
+        data = self._pytesseract.image_to_data(
+            image,
+            output_type=self._pytesseract.Output.DICT,
+            config=(
+                f"-c tessedit_char_whitelist={CHAR_WHITELIST}"
+                f" -c tessedit_char_blacklist={CHAR_BLACKLIST}"
+                f" --psm {psm}"
+                " --oem 3"
+            ),
+        )
+        # levels 1-4 are page/block/paragraph/line; index 4 is the first word
+        if len(data["text"]) < 5:
+            return "", -1
+        return str(data["text"][4]).strip(), int(float(data["conf"][4]))
+
+
+class TesserocrBackend(OCRBackend):
+    """
+    Keep tesseract engines loaded in memory, per page segmentation mode.
+    An engine serves one image at a time; up to max_engines per mode are
+    created so concurrent callers do not queue behind each other.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self, max_engines=4):
+        if tesserocr is None:
+            raise ImportError("tesserocr is not installed")
+        self.max_engines = max_engines
+        self._free = {}
+        self._created = {}
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _acquire(self, psm):
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("OCR backend is closed")
+                free = self._free.setdefault(psm, [])
+                if free:
+                    return free.pop()
+                if self._created.get(psm, 0) < self.max_engines:
+                    self._created[psm] = self._created.get(psm, 0) + 1
+                    break
+                self._cond.wait()
+        try:
+            api = tesserocr.PyTessBaseAPI(psm=psm, oem=tesserocr.OEM.DEFAULT)
+        except Exception:
+            with self._cond:
+                self._created[psm] -= 1
+                self._cond.notify()
+            raise
+        api.SetVariable("tessedit_char_whitelist", CHAR_WHITELIST)
+        api.SetVariable("tessedit_char_blacklist", CHAR_BLACKLIST)
+        return api
+
+    def _release(self, psm, api):
+        with self._cond:
+            if self._closed:
+                # the backend was closed while this engine was in use
+                api.End()
+                self._cond.notify_all()
+                return
+            self._free.setdefault(psm, []).append(api)
+            self._cond.notify()
+
+    def recognise(self, image, psm=PSM_LINE):
+        api = self._acquire(psm)
+        try:
+            api.SetImage(image.convert("L"))
+            words = api.GetUTF8Text().split()
+            confs = api.AllWordConfidences()
+            api.Clear()
+        finally:
+            self._release(psm, api)
+        if not words:
+            return "", -1
+        return words[0], int(confs[0]) if confs else -1
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for free in self._free.values():
+                for api in free:
+                    api.End()
+            self._free.clear()
+            self._created.clear()
+            # callers waiting for an engine raise instead of hanging
+            self._cond.notify_all()
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_ocr_backend(name=None) -> OCRBackend:
+    """Return the process-wide OCR backend, creating it on first use; switching
+    to another backend closes the previous one."""
+    global _backend
+    name = name or OCR_BACKEND
+    with _backend_lock:
+        if _backend is not None and name in ("auto", _backend.name):
+            return _backend
+        if name in ("auto", "tesserocr"):
+            try:
+                backend = TesserocrBackend()
+            except ImportError as e:
+                if name == "tesserocr":
+                    raise e
+                logger.info("tesserocr not available, OCR falls back to subprocess")
+                backend = TesseractSubprocessBackend()
+        elif name == "subprocess":
+            backend = TesseractSubprocessBackend()
+        else:
+            raise ValueError(f"Unknown OCR backend: {name}")
+        if _backend is not None:
+            _backend.close()
+        _backend = backend
+        return _backend
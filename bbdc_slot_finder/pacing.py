@@ -0,0 +1,236 @@
+#!/usr/bin/python3
+# coding: utf-8
+"""
+Request pacing for the scan loop.
+
+Every request of an account waits on a Pacer first. The wait is the longest of
+  - the account's token bucket and the process-wide token bucket, which cap
+    the request rate (with some burst),
+  - the account's adaptive interval since its previous request,
+plus a random jitter.
+
+The adaptive interval shrinks step by step while requests succeed quickly and
+grows on non-success or slow responses, so an account is polled as fast as
+the server tolerates. Every wait is recorded in the pacer's metrics.
+"""
+import asyncio
+import random
+import time
+from bbdc_slot_finder.logger import logger
+
+JITTERS = ["none", "uniform", "exponential"]
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst):
+        """
+        Args:
+            rate (float): tokens added per second
+            burst (int): bucket size
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """Take a token; returns the seconds until it is actually available."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+
+class PacingMetrics(object):
+    def __init__(self):
+        self.waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.slow = 0
+
+    def add_wait(self, seconds):
+        self.waits += 1
+        self.total_wait += seconds
+        self.max_wait = max(self.max_wait, seconds)
+        self.last_wait = seconds
+
+    def as_dict(self):
+        return {
+            "waits": self.waits,
+            "mean_wait": self.total_wait / self.waits if self.waits else 0.0,
+            "max_wait": self.max_wait,
+            "last_wait": self.last_wait,
+            "successes": self.successes,
+            "failures": self.failures,
+            "slow": self.slow,
+        }
+
+
+class Pacer(object):
+    def __init__(
+        self,
+        name,
+        bucket: TokenBucket,
+        global_bucket: TokenBucket = None,
+        min_interval=2,
+        max_interval=120,
+        start_interval=5,
+        jitter="uniform",
+        jitter_scale=2,
+        backoff=2.0,
+        recover=0.8,
+        slow_response=5.0,
+    ):
+        """
+        Args:
+            name (str): account the pacer belongs to, for logs and metrics
+            bucket (TokenBucket): the account's rate limit
+            global_bucket (TokenBucket): shared by all accounts
+            min_interval, max_interval (float): bounds of the adaptive
+                interval between two requests, in seconds
+            start_interval (float): interval before any response was seen
+            jitter (str): one of JITTERS
+            jitter_scale (float): upper bound (uniform) or mean (exponential)
+                of the jitter, in seconds
+            backoff (float): interval factor after a failed or slow response
+            recover (float): interval factor after a quick success
+            slow_response (float): seconds above which a response is slow
+        """
+        if jitter not in JITTERS:
+            raise ValueError(f"Unknown jitter: {jitter}")
+        self.name = name
+        self.bucket = bucket
+        self.global_bucket = global_bucket
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min(max(start_interval, min_interval), max_interval)
+        self.jitter = jitter
+        self.jitter_scale = jitter_scale
+        self.backoff = backoff
+        self.recover = recover
+        self.slow_response = slow_response
+        self.metrics = PacingMetrics()
+        self._next = 0.0  # monotonic time the next request may start
+
+    def _jitter(self, scale):
+        if self.jitter == "uniform":
+            return random.uniform(0, scale)
+        if self.jitter == "exponential":
+            return min(random.expovariate(1 / scale), 3 * scale) if scale else 0.0
+        return 0.0
+
+    def delay(self, minimum=0.0, jitter_scale=None) -> float:
+        """Reserve the next request slot; returns how long to wait for it."""
+        now = time.monotonic()
+        delay = max(self._next - now, self.bucket.reserve(), minimum)
+        if self.global_bucket is not None:
+            delay = max(delay, self.global_bucket.reserve())
+        scale = self.jitter_scale if jitter_scale is None else jitter_scale
+        delay += self._jitter(scale)
+        # concurrent requests of the account queue up one interval apart
+        self._next = now + delay + self.interval
+        return delay
+
+    async def wait(self, minimum=0.0, jitter_scale=None) -> float:
+        """
+        Args:
+            minimum (float): wait at least this long
+            jitter_scale (float): override the configured jitter scale
+        Returns:
+            the seconds waited
+        """
+        seconds = self.delay(minimum, jitter_scale)
+        self.metrics.add_wait(seconds)
+        logger.debug(f"pacing {self.name}: wait {seconds:.2f}s")
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+        return seconds
+
+    def record(self, success: bool, elapsed: float):
+        """Adapt the interval to the outcome of a request that took elapsed s."""
+        if not success:
+            self.metrics.failures += 1
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+            logger.info(f"pacing {self.name}: failure, interval {self.interval:.1f}s")
+        elif elapsed > self.slow_response:
+            self.metrics.slow += 1
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+            logger.info(f"pacing {self.name}: slow, interval {self.interval:.1f}s")
+        else:
+            self.metrics.successes += 1
+            self.interval = max(self.interval * self.recover, self.min_interval)
+
+    def report(self) -> str:
+        m = self.metrics.as_dict()
+        return (
+            f"pacing {self.name}: interval {self.interval:.1f}s, "
+            f"{m['waits']} waits, mean {m['mean_wait']:.2f}s, max {m['max_wait']:.2f}s, "
+            f"{m['successes']} ok / {m['failures']} failed / {m['slow']} slow"
+        )
+
+
+class PacingPolicy(object):
+    def __init__(
+        self,
+        global_rate=2.0,
+        global_burst=5,
+        account_rate=0.5,
+        account_burst=3,
+        **pacer_kwargs,
+    ):
+        """
+        Args:
+            global_rate, global_burst: token bucket shared by every account
+            account_rate, account_burst: token bucket of each account
+            pacer_kwargs: passed to every Pacer (min_interval, jitter, ...)
+        """
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.account_rate = account_rate
+        self.account_burst = account_burst
+        self.pacer_kwargs = pacer_kwargs
+        self._pacers = {}
+
+    def pacer(self, account) -> Pacer:
+        account = str(account)
+        if account not in self._pacers:
+            self._pacers[account] = Pacer(
+                account,
+                TokenBucket(self.account_rate, self.account_burst),
+                self.global_bucket,
+                **self.pacer_kwargs,
+            )
+        return self._pacers[account]
+
+    def metrics(self) -> dict:
+        """{account: metrics dict} of every pacer."""
+        return {
+            name: dict(p.metrics.as_dict(), interval=p.interval)
+            for name, p in self._pacers.items()
+        }
+
+
+_policy = None
+
+
+def configure_pacing(**kwargs) -> PacingPolicy:
+    """Replace the process-wide policy, e.g. from the `pacing` bot config."""
+    global _policy
+    _policy = PacingPolicy(**kwargs)
+    return _policy
+
+
+def get_pacer(account) -> Pacer:
+    global _policy
+    if _policy is None:
+        _policy = PacingPolicy()
+    return _policy.pacer(account)
+
+
+def pacing_metrics() -> dict:
+    return _policy.metrics() if _policy is not None else {}
@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+# coding: utf-8
+"""
+Shared released-slot fetches across users.
+
+listC3PracticalSlotReleased returns the same calendar to every account of a
+course type, so there is no point in every camping user fetching it. The
+coordinator keys fetches by (courseType, month): within one tick, the first
+session to ask for a key fetches it with its own page and pacing, sessions
+asking meanwhile wait for that fetch, and sessions asking later in the tick
+get the stored result. Upstream requests then grow with the number of
+distinct keys, not with the number of users.
+
+Personal data is not shared: other sessions get the calendar without
+`accountBal` and without the encrypted booking tokens of the slots, and
+have to fetch the month themselves before booking through the API.
+
+A session served from the shared results sends no request with its own
+token, so an expired login would only show when it books. Every session
+therefore fetches for itself at its first scan and again once `verify_every`
+seconds have passed since its last own fetch.
+"""
+import asyncio
+import copy
+import time
+from bbdc_slot_finder.logger import logger
+
+# per-account fields of a listC3PracticalSlotReleased response
+PERSONAL_FIELDS = ["accountBal"]
+PERSONAL_SLOT_FIELDS = ["slotIdEnc", "bookingProgressEnc"]
+
+
+def strip_personal(data: dict) -> dict:
+    """Copy of a released-slot response without per-account fields."""
+    if not data:
+        return data
+    shared = copy.deepcopy(data)
+    for field in PERSONAL_FIELDS:
+        shared.pop(field, None)
+    for slots in (shared.get("releasedSlotListGroupByDay") or {}).values():
+        for slot in slots:
+            for field in PERSONAL_SLOT_FIELDS:
+                slot[field] = None
+    return shared
+
+
+class _SharedScan(object):
+    def __init__(self):
+        self.task = None  # fetch in flight
+        self.owner = None
+        self.data = None
+        self.fetched = 0.0
+        self.subscribers = set()
+
+
+class ScanCoordinator(object):
+    def __init__(self, tick=15, verify_every=300):
+        """
+        Args:
+            tick (float): seconds a fetched result is served to other users;
+                0 disables sharing.
+            verify_every (float): seconds after which a session served from
+                shared results fetches with its own token again, so an
+                expired login is noticed.
+        """
+        self.tick = tick
+        self.verify_every = verify_every
+        self._scans = {}  # (courseType, month): _SharedScan
+        self._own_fetched = {}  # owner: time of its last own fetch
+        self.fetches = 0
+        self.shared = 0
+
+    def subscribers(self, key) -> int:
+        scan = self._scans.get(key)
+        return len(scan.subscribers) if scan else 0
+
+    async def fetch(self, key, owner, fetch):
+        """
+        Args:
+            key (tuple): (courseType, month)
+            owner: the session asking, e.g. its chat id
+            fetch: coroutine function doing the actual request for owner
+        Returns:
+            the response data; a shared copy if another session fetched it
+        """
+        if not self.tick:
+            return await fetch()
+        scan = self._scans.setdefault(key, _SharedScan())
+        scan.subscribers.add(owner)
+        # time to check this session's own login again
+        verify = (
+            time.monotonic() - self._own_fetched.get(owner, 0) >= self.verify_every
+        )
+        task = scan.task
+        if (
+            not verify
+            and task is not None
+            and not task.done()
+            and scan.owner != owner
+        ):
+            try:
+                data = await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.cancelled():
+                    raise  # this session was cancelled, not the fetch
+                # the other session's fetch was cancelled (e.g. its job ended)
+                return await self._fetch_own(owner, fetch)
+            except Exception:
+                # the other session's failure (e.g. its login expired) is not ours
+                return await self._fetch_own(owner, fetch)
+            self.shared += 1
+            return strip_personal(data)
+        if (
+            not verify
+            and scan.data is not None
+            and scan.owner != owner
+            and time.monotonic() - scan.fetched < self.tick
+        ):
+            self.shared += 1
+            return strip_personal(scan.data)
+        scan.owner = owner
+        scan.task = asyncio.ensure_future(self._fetch_own(owner, fetch))
+        try:
+            data = await scan.task
+        except Exception:
+            scan.data = None
+            raise
+        self.fetches += 1
+        scan.data = data
+        scan.fetched = time.monotonic()
+        logger.debug(f"fetched {key} for {len(scan.subscribers)} subscribers")
+        return data
+
+    async def _fetch_own(self, owner, fetch):
+        data = await fetch()
+        self._own_fetched[owner] = time.monotonic()
+        return data
+
+    def unsubscribe(self, owner):
+        for scan in self._scans.values():
+            scan.subscribers.discard(owner)
+        self._own_fetched.pop(owner, None)
+
+
+_coordinator = None
+
+
+def configure_scan_coordinator(**kwargs) -> ScanCoordinator:
+    """Replace the process-wide coordinator, e.g. from the `shared_scan` bot config."""
+    global _coordinator
+    _coordinator = ScanCoordinator(**kwargs)
+    return _coordinator
+
+
+def get_scan_coordinator() -> ScanCoordinator:
+    global _coordinator
+    if _coordinator is None:
+        _coordinator = ScanCoordinator()
+    return _coordinator
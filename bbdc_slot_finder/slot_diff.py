@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+# coding: utf-8
+"""
+Incremental diff of released slots.
+
+SlotDiff keeps the last snapshot of every month and turns each newly fetched
+month into added / removed / changed events, stamped with when the slot was
+first and last seen. The merged view of all months (UserSession.released_slots)
+is updated month by month, so a scan that fails halfway keeps the months it
+already fetched and does not announce them again on the next scan.
+"""
+import datetime
+from bbdc_slot_finder.slot_store import SlotStore
+
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+# slot fields that do not make a slot "changed" (per-request booking tokens)
+VOLATILE_FIELDS = ["slot_id_enc", "booking_progress_enc"]
+
+
+class SlotEvent(object):
+    __slots__ = ("kind", "key", "slot", "previous", "first_seen", "last_seen")
+
+    def __init__(self, kind, key, slot, previous=None, first_seen=None, last_seen=None):
+        """
+        Args:
+            kind (str): ADDED, REMOVED or CHANGED
+            key (str): slot key, %Y%m%d<session>-<slot id>
+            slot (Slot): the slot as now seen (as last seen, if removed)
+            previous (Slot): the slot before a change
+            first_seen, last_seen (datetime.datetime)
+        """
+        self.kind = kind
+        self.key = key
+        self.slot = slot
+        self.previous = previous
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+
+    def __repr__(self):
+        return f"SlotEvent({self.kind}, {self.key})"
+
+
+def month_of(key) -> str:
+    return str(key)[:6]
+
+
+def _public(slot):
+    return slot._replace(**dict.fromkeys(VOLATILE_FIELDS))
+
+
+class SlotDiff(object):
+    def __init__(self, slots=None):
+        """
+        Args:
+            slots (SlotStore): merged view to keep up to date, e.g. an
+                existing released_slots store; a new one if None.
+        """
+        self.slots = SlotStore() if slots is None else slots
+        self._months = {}  # month: {key: slot}
+        self._seen = {}  # key: (first seen, last seen)
+
+    def months(self):
+        return sorted(self._months)
+
+    def update_month(self, month, slots: dict, now=None):
+        """
+        Replace the snapshot of a month with freshly fetched slots.
+        Returns:
+            list of SlotEvent
+        """
+        now = now or datetime.datetime.now()
+        month = str(month)
+        old = self._months.get(month, {})
+        events = []
+        for key, slot in slots.items():
+            first_seen = self._seen.get(key, (now, now))[0]
+            self._seen[key] = (first_seen, now)
+            if key not in old:
+                events.append(SlotEvent(ADDED, key, slot, None, first_seen, now))
+            elif _public(old[key]) != _public(slot):
+                events.append(SlotEvent(CHANGED, key, slot, old[key], first_seen, now))
+        for key in old.keys() - slots.keys():
+            first_seen, last_seen = self._seen.pop(key, (None, None))
+            events.append(SlotEvent(REMOVED, key, old[key], None, first_seen, last_seen))
+        self._months[month] = dict(slots)
+        # the merged view may hold slots of the month added by other code
+        for key in [k for k in self.slots.keys_in_month(month) if k not in slots]:
+            del self.slots[key]
+        self.slots.update(slots)
+        return events
+
+    def retain_months(self, months, now=None):
+        """
+        Drop the months not in `months`, e.g. no longer open or wanted after
+        a complete scan.
+        Returns:
+            list of REMOVED SlotEvent
+        """
+        months = {str(m) for m in months}
+        events = []
+        for month in [m for m in self._months if m not in months]:
+            events += self.update_month(month, {}, now)
+            del self._months[month]
+        return events
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+# coding: utf-8
+"""
+Indexed store of released slots.
+
+SlotStore is a {slot key: Slot} mapping that iterates in key order, which is
+chronological (keys are "%Y%m%d<session>-<slot id>"). The sorted key list and
+the month, date, session and fee indexes are updated on every insert and
+delete, so queries such as "slots up to tomorrow in sessions 2 and 3" do not
+scan or sort all slots.
+"""
+import bisect
+import datetime
+from collections.abc import MutableMapping
+
+
+def _date_code(day) -> str:
+    """datetime.date or %Y-%m-%d -> %Y%m%d"""
+    if isinstance(day, (datetime.date, datetime.datetime)):
+        return day.strftime("%Y%m%d")
+    return str(day).replace("-", "")
+
+
+class SlotStore(MutableMapping):
+    def __init__(self, slots=None):
+        self._slots = {}
+        self._keys = []  # sorted slot keys
+        self._fees = []  # sorted (fee, key)
+        self._by_month = {}  # "%Y%m": set of keys
+        self._by_date = {}  # "%Y-%m-%d": set of keys
+        self._by_session = {}  # "1".."8": set of keys
+        if slots:
+            self.update(slots)
+
+    def __getitem__(self, key):
+        return self._slots[key]
+
+    def __setitem__(self, key, slot):
+        if key in self._slots:
+            del self[key]
+        self._slots[key] = slot
+        bisect.insort(self._keys, key)
+        bisect.insort(self._fees, (slot.total_fee, key))
+        self._by_month.setdefault(slot.month, set()).add(key)
+        self._by_date.setdefault(slot.slot_date, set()).add(key)
+        self._by_session.setdefault(slot.session, set()).add(key)
+
+    def __delitem__(self, key):
+        slot = self._slots.pop(key)
+        del self._keys[bisect.bisect_left(self._keys, key)]
+        del self._fees[bisect.bisect_left(self._fees, (slot.total_fee, key))]
+        for index, value in (
+            (self._by_month, slot.month),
+            (self._by_date, slot.slot_date),
+            (self._by_session, slot.session),
+        ):
+            index[value].discard(key)
+            if not index[value]:
+                del index[value]
+
+    def __iter__(self):
+        return iter(list(self._keys))
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def __repr__(self):
+        return f"SlotStore({len(self)} slots)"
+
+    def clear(self):
+        self.__init__()
+
+    def months(self) -> list:
+        return sorted(self._by_month)
+
+    def dates(self) -> list:
+        """%Y-%m-%d dates that have slots, in order."""
+        return sorted(self._by_date)
+
+    def keys_in_month(self, month) -> list:
+        return sorted(self._by_month.get(str(month), ()))
+
+    def on_date(self, day) -> list:
+        """Slots of one day (datetime.date or %Y-%m-%d), by session."""
+        if isinstance(day, (datetime.date, datetime.datetime)):
+            day = day.strftime("%Y-%m-%d")
+        return [self._slots[k] for k in sorted(self._by_date.get(day, ()))]
+
+    def in_sessions(self, sessions) -> list:
+        keys = set()
+        for session in sessions:
+            keys |= self._by_session.get(str(session), set())
+        return [self._slots[k] for k in sorted(keys)]
+
+    def between(self, start=None, end=None) -> list:
+        """Slots from the start date to the end date, both included."""
+        lo = 0 if start is None else bisect.bisect_left(self._keys, _date_code(start))
+        hi = len(self._keys)
+        if end is not None:
+            # "~" sorts after every session digit and "-"
+            hi = bisect.bisect_right(self._keys, _date_code(end) + "~")
+        return [self._slots[k] for k in self._keys[lo:hi]]
+
+    def cheaper_than(self, max_fee) -> list:
+        hi = bisect.bisect_right(self._fees, (max_fee, "~"))
+        return [self._slots[k] for _, k in self._fees[:hi]]
+
+    def query(self, start=None, end=None, sessions=None, max_fee=None) -> list:
+        """
+        Slots in a date range (both ends included), optionally only in some
+        sessions and up to a fee, in chronological order. E.g. slots within
+        24h in sessions 2 and 3:
+            store.query(end=tomorrow, sessions=["2", "3"])
+        """
+        slots = self.between(start, end)
+        if sessions is not None:
+            wanted = set()
+            for session in sessions:
+                wanted |= self._by_session.get(str(session), set())
+            slots = [s for s in slots if s.key in wanted]
+        if max_fee is not None:
+            slots = [s for s in slots if s.total_fee <= max_fee]
+        return slots
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+# coding: utf-8
+"""
+Released slot records.
+
+parse_released_slots turns a listC3PracticalSlotReleased response into
+{slot key: Slot}. Slot is a NamedTuple (no per-instance dict); the dates,
+sessions and times it holds are shared string objects, and each day of a
+response is parsed once. slot_to_dict / slot_from_dict convert to and from the
+plain dict layout for json files and logs.
+
+Slot keys are "%Y%m%d<session>-<slot id>", e.g. "202504292-1234567".
+"""
+import datetime
+import functools
+import sys
+from typing import NamedTuple
+
+
+class Slot(NamedTuple):
+    key: str
+    slot_id: int
+    slot_date: str  # %Y-%m-%d
+    session: str  # "1" to "8"
+    start_time: str  # %H:%M
+    end_time: str
+    total_fee: float
+    group: object  # c3PsrFixGrpNo
+    slot_id_enc: str  # booking tokens, None if shared by another account
+    booking_progress_enc: str
+
+    @property
+    def slots_code(self) -> str:
+        return self.key
+
+    @property
+    def month(self) -> str:
+        return self.key[:6]
+
+    @property
+    def day(self) -> datetime.date:
+        return _day(self.slot_date)
+
+    @property
+    def payload(self) -> dict:
+        """The slot's entry of encryptSlotList in a booking request."""
+        return {
+            "slotIdEnc": self.slot_id_enc,
+            "bookingProgressEnc": self.booking_progress_enc,
+        }
+
+
+@functools.lru_cache(maxsize=1024)
+def _day(slot_date) -> datetime.date:
+    return datetime.date.fromisoformat(slot_date)
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_day(day):
+    """'2025-04-29 00:00:00' -> ('20250429', '2025-04-29'), shared strings."""
+    slot_date = sys.intern(day[:10])
+    return slot_date.replace("-", ""), slot_date
+
+
+def parse_released_slots(data: dict) -> dict:
+    """Parse released slots data and return a dictionary of parsed slot information.
+
+    Args:
+        data (dict): A dictionary containing released slot data.
+
+    Returns:
+        dict: {slot key: Slot}; None if there is no data.
+    """
+    if not data:
+        return
+    slot_list = {}
+    slot_data = data["releasedSlotListGroupByDay"]
+    if slot_data is None:
+        return slot_list
+    intern = sys.intern
+    for day, slots in slot_data.items():
+        date_code, slot_date = _parse_day(day)
+        for slot in slots:
+            session = intern(slot["slotRefName"].rpartition(" ")[2])
+            slot_id = int(slot["slotId"])
+            key = f"{date_code}{session}-{slot_id}"
+            slot_list[key] = Slot(
+                key,
+                slot_id,
+                slot_date,
+                session,
+                intern(slot["startTime"]),
+                intern(slot["endTime"]),
+                slot["totalFee"],
+                slot["c3PsrFixGrpNo"],
+                slot["slotIdEnc"],
+                slot["bookingProgressEnc"],
+            )
+    return slot_list
+
+
+def slot_to_dict(slot: Slot) -> dict:
+    """The dict layout slots used to be kept in."""
+    return {
+        "payload": slot.payload,
+        "slot_id": slot.slot_id,
+        "total_fee": slot.total_fee,
+        "slots_code": slot.key,
+        "slot_date": slot.slot_date,
+        "group": slot.group,
+        "session": slot.session,
+        "start_time": slot.start_time,
+        "end_time": slot.end_time,
+    }
+
+
+def slot_from_dict(slot: dict) -> Slot:
+    payload = slot.get("payload") or {}
+    return Slot(
+        slot["slots_code"],
+        int(slot["slot_id"]),
+        sys.intern(slot["slot_date"]),
+        sys.intern(slot["session"]),
+        sys.intern(slot["start_time"]),
+        sys.intern(slot["end_time"]),
+        slot["total_fee"],
+        slot["group"],
+        payload.get("slotIdEnc"),
+        payload.get("bookingProgressEnc"),
+    )
+
+
+def slots_to_dicts(slots: dict) -> dict:
+    return {key: slot_to_dict(slot) for key, slot in slots.items()}
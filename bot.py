@@ -1,3 +1,4 @@
+import os
 from bbdc_bot.logger import logger
 from telegram import Update, ForceReply
 from telegram.ext import (
@@ -5,7 +6,23 @@ from telegram.ext import (
     CommandHandler,
 )
 from bbdc_slot_finder.config import load_config
+from bbdc_slot_finder.pacing import configure_pacing
+from bbdc_slot_finder.scan_coordinator import configure_scan_coordinator
+from bbdc_slot_finder.http_client import (
+    close_http_transport,
+    configure_http_transport,
+)
+from bbdc_slot_finder.browser_manager import (
+    close_browser_manager,
+    configure_browser_manager,
+)
+from bbdc_slot_finder.event_loop import start_loop_watchdog, stop_loop_watchdog
+from bbdc_slot_finder.captcha_service import (
+    configure_captcha_service,
+    get_captcha_service,
+)
 from bbdc_bot import book_slot_handler, config_conv_handler
+from bbdc_bot.camp_schedule import configure_burst_budget
 from bbdc_bot.conv_cancel_slots import cancel_slot_handler
 from bbdc_bot.bbdc_bot import (
     command_camp,
@@ -23,6 +40,7 @@ from bbdc_bot.browser_ops import (
     command_pause_browser,
 )
 
+DEBUG = os.environ.get("BBDC_BOT_DEBUG", False)
 CONFIG = load_config("config_bot.yaml")
 TOKEN = CONFIG["telegram"]["token"]
 ADMIN = CONFIG["telegram"].get("admin", [])
@@ -36,18 +54,34 @@ filterwarnings(
 )
 
 
+async def post_init(application):
+    if DEBUG:
+        # log the stack of anything that blocks the event loop
+        start_loop_watchdog(**CONFIG.get("watchdog", {}))
+
+
 async def post_stop(context):
     for key in context.chat_data.keys():
         config = context.chat_data[key].get("config", None)
         session = context.chat_data[key].get("client", False)
         if session is not False:
             await session.close_client()
+    await close_browser_manager()
+    await close_http_transport()
+    get_captcha_service().shutdown()
+    stop_loop_watchdog()
 
     print("stop")
 
 
 def main() -> None:
     """Run bot."""
+    configure_captcha_service(**CONFIG.get("captcha", {}))
+    configure_browser_manager(**CONFIG.get("browser", {}))
+    configure_pacing(**CONFIG.get("pacing", {}))
+    configure_scan_coordinator(**CONFIG.get("shared_scan", {}))
+    configure_http_transport(**CONFIG.get("http", {}))
+    configure_burst_budget(**CONFIG.get("camp", {}))
     application = Application.builder().token(TOKEN).build()
 
     application.add_handler(CommandHandler(["start"], command_start))
@@ -64,6 +98,7 @@ def main() -> None:
     application.add_handler(command_quit_browser)
     application.add_handler(command_open_browser)
     application.add_handler(command_pause_browser)
+    application.post_init = post_init
     application.post_stop = post_stop
     application.run_polling(
         poll_interval=2,
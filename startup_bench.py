@@ -0,0 +1,83 @@
+"""
+Startup import benchmark for the bot.
+
+Imports `bot` in a fresh interpreter with `python -X importtime`, prints the
+total import time and the slowest top-level imports, and fails if one of the
+heavy stacks that should load lazily (captcha, calendar, selenium, playwright)
+was imported at startup.
+
+    python startup_bench.py [--module bot] [--top 10] [--runs 3]
+"""
+import argparse
+import subprocess
+import sys
+
+# modules that must only be imported on first use
+LAZY_MODULES = [
+    "numpy",
+    "PIL",
+    "cv2",
+    "pytesseract",
+    "tesserocr",
+    "pandas",
+    "icalendar",
+    "selenium",
+    "seleniumwire",
+    "playwright",
+]
+
+
+def import_times(module="bot"):
+    """
+    Returns:
+        list of (depth, module name, cumulative microseconds) in import order
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((depth, name.strip(), int(cumulative)))
+    return rows
+
+
+def main():
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-m", "--module", default="bot")
+    argparser.add_argument("-t", "--top", type=int, default=10)
+    argparser.add_argument("-r", "--runs", type=int, default=3)
+    args = argparser.parse_args()
+
+    totals = []
+    for _ in range(args.runs):
+        rows = import_times(args.module)
+        totals.append(next(t for d, n, t in rows if n == args.module))
+    print(
+        f"import {args.module}: best {min(totals) / 1000:.0f} ms, "
+        f"median {sorted(totals)[len(totals) // 2] / 1000:.0f} ms "
+        f"over {args.runs} runs"
+    )
+
+    # slowest top-level packages, wherever in the tree they were first imported
+    packages = [r for r in rows if "." not in r[1] and r[1] != args.module]
+    for _, name, cumulative in sorted(packages, key=lambda r: -r[2])[: args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    loaded = sorted({n.split(".")[0] for _, n, _ in rows} & set(LAZY_MODULES))
+    if loaded:
+        print(f"Loaded at startup but should be lazy: {', '.join(loaded)}")
+        return 1
+    print("No lazily-loaded stack was imported at startup.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())